@@ -0,0 +1,355 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import etl_script as etl
+from mock_servers import archive_response, sp500_closes, start_mock_server, CHART_PATH, WEATHER_PATH
+
+# Setup basic logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Constants
+BENCH_DATA_DIR = "bench_data"
+BENCH_RESULTS_FILE = "bench_results.jsonl"
+DEFAULT_SCALES = [10_000, 100_000]
+BENCH_WEATHER_RPS = 10_000  # Effectively unthrottled so runs measure the pipeline, not the API quota
+
+# Cardinalities observed in the public Olist dataset (~112k items, ~99k orders, ~3k sellers)
+ITEMS_PER_ORDER_EXTRA = 0.14  # Poisson mean of items beyond the first per order
+ORDERS_PER_SELLER = 33
+ZIP_PREFIXES = 19_000
+GEO_ROWS_PER_ZIP = 53
+DELIVERED_SHARE = 0.97
+PURCHASE_START = pd.Timestamp("2016-09-04")
+PURCHASE_DAYS = 760
+CITY_NAMES = [
+    "são paulo", "rio de janeiro", "belo horizonte", "brasília", "curitiba", "campinas",
+    "porto alegre", "salvador", "guarulhos", "São Bernardo do Campo", "niterói", "santo andré",
+    "osasco", "goiânia", " Ribeirão Preto", "florianópolis", "recife", "fortaleza", "manaus", "belém",
+]
+STATES = ["SP", "RJ", "MG", "DF", "PR", "RS", "BA", "SC", "GO", "PE", "CE", "AM", "PA"]
+HEX_PAIRS = np.array([f"{i:02x}" for i in range(256)])
+
+
+def hex_ids(rng, n):
+    """
+    Generate Olist-style 32-character hex IDs without a Python-level loop.
+    Args:
+        rng (np.random.Generator): Random generator.
+        n (int): Number of IDs.
+    Returns:
+        np.ndarray: Array of 32-character hex strings.
+    """
+    pairs = HEX_PAIRS[rng.integers(0, 256, size=(n, 16), dtype=np.uint8)]
+    return np.ascontiguousarray(pairs).view('<U32').ravel()
+
+def format_timestamps(values):
+    """
+    Format datetime64 values the way the Olist CSVs do.
+    Args:
+        values (pd.DatetimeIndex): Timestamps.
+    Returns:
+        np.ndarray: Strings formatted as YYYY-MM-DD HH:MM:SS.
+    """
+    return values.strftime("%Y-%m-%d %H:%M:%S").to_numpy()
+
+def generate_synthetic_olist(out_dir, n_order_items, seed=42, chunk_orders=500_000):
+    """
+    Write synthetic Olist-shaped CSVs with realistic ID, zip and geolocation cardinalities.
+    Orders, items and customers are generated in chunks so very large scales never
+    have to fit in memory at once.
+    Args:
+        out_dir (str): Directory to write the five CSVs into.
+        n_order_items (int): Approximate number of order item rows.
+        seed (int): Random seed; the same seed and scale always produce the same files.
+        chunk_orders (int): Orders generated per chunk.
+    Returns:
+        dict: Row counts per generated file.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    n_orders = max(1, int(n_order_items / (1 + ITEMS_PER_ORDER_EXTRA)))
+    n_sellers = max(10, n_orders // ORDERS_PER_SELLER)
+    n_zips = min(ZIP_PREFIXES, max(50, n_orders // 5))
+
+    # Zip prefixes with a centroid inside Brazil; geolocation rows jitter around it
+    zips = np.char.zfill(rng.choice(np.arange(1000, 100_000), n_zips, replace=False).astype(str), 5)
+    zip_lat = rng.uniform(-30.0, -3.0, n_zips)
+    zip_lng = rng.uniform(-55.0, -35.0, n_zips)
+    zip_city = rng.choice(CITY_NAMES, n_zips)
+    zip_state = rng.choice(STATES, n_zips)
+    geo_zip = rng.integers(0, n_zips, n_zips * GEO_ROWS_PER_ZIP)
+    geolocations = pd.DataFrame({
+        'geolocation_zip_code_prefix': zips[geo_zip],
+        'geolocation_lat': zip_lat[geo_zip] + rng.normal(0, 0.02, len(geo_zip)),
+        'geolocation_lng': zip_lng[geo_zip] + rng.normal(0, 0.02, len(geo_zip)),
+        'geolocation_city': zip_city[geo_zip],
+        'geolocation_state': zip_state[geo_zip],
+    })
+    geolocations.to_csv(os.path.join(out_dir, etl.OLIST_GEO_CSV), index=False)
+
+    seller_ids = hex_ids(rng, n_sellers)
+    seller_zip = rng.integers(0, n_zips, n_sellers)
+    pd.DataFrame({
+        'seller_id': seller_ids,
+        'seller_zip_code_prefix': zips[seller_zip],
+        'seller_city': zip_city[seller_zip],
+        'seller_state': zip_state[seller_zip],
+    }).to_csv(os.path.join(out_dir, etl.OLIST_SELLERS_CSV), index=False)
+
+    counts = {'orders': 0, 'order_items': 0, 'customers': 0}
+    for start in range(0, n_orders, chunk_orders):
+        n = min(chunk_orders, n_orders - start)
+        first = start == 0
+        customer_ids = hex_ids(rng, n)
+        customer_zip = rng.integers(0, n_zips, n)
+        pd.DataFrame({
+            'customer_id': customer_ids,
+            'customer_unique_id': hex_ids(rng, n),
+            'customer_zip_code_prefix': zips[customer_zip],
+            'customer_city': zip_city[customer_zip],
+            'customer_state': zip_state[customer_zip],
+        }).to_csv(os.path.join(out_dir, etl.OLIST_CUSTOMERS_CSV), index=False, mode='w' if first else 'a', header=first)
+
+        order_ids = hex_ids(rng, n)
+        purchased = PURCHASE_START + pd.to_timedelta(rng.integers(0, PURCHASE_DAYS * 86400, n), unit='s')
+        delivered = purchased + pd.to_timedelta(rng.integers(2 * 86400, 30 * 86400, n), unit='s')
+        status = np.where(rng.random(n) < DELIVERED_SHARE, 'delivered', 'shipped')
+        delivered_str = np.where(status == 'delivered', format_timestamps(delivered), '')
+        pd.DataFrame({
+            'order_id': order_ids,
+            'customer_id': customer_ids,
+            'order_status': status,
+            'order_purchase_timestamp': format_timestamps(purchased),
+            'order_approved_at': format_timestamps(purchased + pd.Timedelta(minutes=15)),
+            'order_delivered_carrier_date': '',
+            'order_delivered_customer_date': delivered_str,
+            'order_estimated_delivery_date': format_timestamps(purchased.normalize() + pd.Timedelta(days=25)),
+        }).to_csv(os.path.join(out_dir, etl.OLIST_ORDERS_CSV), index=False, mode='w' if first else 'a', header=first)
+
+        # Most orders have one item; extra items usually come from the same seller
+        items_per_order = 1 + rng.poisson(ITEMS_PER_ORDER_EXTRA, n)
+        item_order = np.repeat(np.arange(n), items_per_order)
+        item_number = np.arange(len(item_order)) - np.repeat(np.cumsum(items_per_order) - items_per_order, items_per_order) + 1
+        order_seller = rng.integers(0, n_sellers, n)
+        item_seller = np.where(rng.random(len(item_order)) < 0.9, order_seller[item_order], rng.integers(0, n_sellers, len(item_order)))
+        pd.DataFrame({
+            'order_id': order_ids[item_order],
+            'order_item_id': item_number,
+            'product_id': hex_ids(rng, len(item_order)),
+            'seller_id': seller_ids[item_seller],
+            'shipping_limit_date': format_timestamps(purchased[item_order] + pd.Timedelta(days=6)),
+            'price': np.round(rng.lognormal(4.3, 0.9, len(item_order)), 2),
+            'freight_value': np.round(rng.gamma(2.0, 10.0, len(item_order)), 2),
+        }).to_csv(os.path.join(out_dir, etl.OLIST_ORDER_ITEMS_CSV), index=False, mode='w' if first else 'a', header=first)
+
+        counts['orders'] += n
+        counts['customers'] += n
+        counts['order_items'] += len(item_order)
+    counts.update({'sellers': n_sellers, 'geolocations': len(geolocations)})
+    return counts
+
+class FakeTicker:
+    """
+    Offline stand-in for yfinance.Ticker returning the mock server's deterministic price series.
+    """
+    latency = 0.0
+
+    def __init__(self, ticker):
+        self.ticker = ticker
+
+    def history(self, start=None, end=None, interval='1d'):
+        """
+        Return a Close series for business days in [start, end).
+        Returns:
+            pd.DataFrame: Frame indexed by tz-aware dates with a Close column.
+        """
+        time.sleep(self.latency)
+        return sp500_closes(start, end).to_frame()
+
+class FakeWeatherResponse:
+    """
+    Minimal requests.Response stand-in carrying an Open-Meteo archive payload.
+    """
+
+    def __init__(self, payload):
+        # Serialized like a real body so JSON decoding is part of the measured cost
+        self.content = json.dumps(payload).encode()
+        self.status_code = 200
+        self.headers = {}
+
+    def raise_for_status(self):
+        return None
+
+    def json(self):
+        return json.loads(self.content)
+
+class FakeWeatherSession:
+    """
+    In-process stand-in for the pooled requests.Session used by batch_fetch_weather.
+    Answers with the same payloads as mock_servers.py, without the HTTP overhead.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+
+    def get(self, url, params=None, timeout=None):
+        """
+        Answer an archive request.
+        Returns:
+            FakeWeatherResponse: Response with daily time/temperature/precipitation arrays.
+        """
+        time.sleep(self.latency)
+        self.requests += 1
+        return FakeWeatherResponse(archive_response({key: [str(value)] for key, value in params.items()}))
+
+    def close(self):
+        return None
+
+def git_revision():
+    """
+    Return the short git commit hash of the working tree, if available.
+    Returns:
+        str: Commit hash or 'unknown'.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return 'unknown'
+
+def run_benchmark(data_dir, weather_latency=0.0, sp500_latency=0.0, streaming=False, keep_caches=False,
+                  weather_rps=BENCH_WEATHER_RPS, use_http=False, error_rate=0.0, throttle_rate=0.0, workers=None):
+    """
+    Run the full ETL once against a synthetic dataset with offline API fakes.
+    Args:
+        data_dir (str): Directory holding the synthetic CSVs.
+        weather_latency (float): Simulated seconds per weather request.
+        sp500_latency (float): Simulated seconds per S&P 500 history call.
+        streaming (bool): Use the streaming pipeline.
+        keep_caches (bool): Keep the weather, market data and columnar caches from earlier runs (warm run).
+        weather_rps (float): Weather rate limit; the production quota would dominate every run against fakes.
+        use_http (bool): Go through a local mock_servers.py instance instead of in-process fakes,
+            exercising the real HTTP client path (pooling, retries).
+        error_rate (float): Share of mock server responses that are HTTP 500 (HTTP mode only).
+        throttle_rate (float): Share of mock server responses that are HTTP 429 (HTTP mode only).
+        workers (int): Worker processes for the streaming pipeline (defaults to etl.STREAM_WORKERS).
+    Returns:
+        dict: Total wall time, per-stage timings, weather request count and retry metrics.
+    """
+    original_ticker = etl.yf.Ticker
+    original_session = etl.create_http_session
+    original_settings = (etl.WEATHER_CACHE_DB, etl.MARKET_DATA_DIR, etl.RUN_REPORT_JSON, etl.WEATHER_REQUESTS_PER_SECOND,
+                         etl.WEATHER_API_URL, etl.SP500_HISTORY_URL)
+    session = FakeWeatherSession(weather_latency)
+    FakeTicker.latency = sp500_latency
+    server = start_mock_server(port=0, latency=weather_latency, error_rate=error_rate,
+                               throttle_rate=throttle_rate, seed=0) if use_http else None
+    cwd = os.getcwd()
+    os.chdir(data_dir)
+    try:
+        if server is not None:
+            etl.WEATHER_API_URL = server.base_url + WEATHER_PATH
+            etl.SP500_HISTORY_URL = server.base_url + CHART_PATH
+        else:
+            etl.yf.Ticker = FakeTicker
+            etl.create_http_session = lambda pool_size=None: session
+        etl.RUN_REPORT_JSON = "bench_run_report.json"
+        etl.WEATHER_REQUESTS_PER_SECOND = weather_rps
+        if not keep_caches:
+            etl.WEATHER_CACHE_DB = None
+            etl.MARKET_DATA_DIR = None
+            if etl.OLIST_CACHE_DIR:
+                shutil.rmtree(etl.OLIST_CACHE_DIR, ignore_errors=True)
+        started = time.perf_counter()
+        etl.main(streaming=streaming, workers=workers)
+        total = time.perf_counter() - started
+        with open(etl.RUN_REPORT_JSON) as f:
+            report = json.load(f)
+    finally:
+        etl.yf.Ticker = original_ticker
+        etl.create_http_session = original_session
+        (etl.WEATHER_CACHE_DB, etl.MARKET_DATA_DIR, etl.RUN_REPORT_JSON, etl.WEATHER_REQUESTS_PER_SECOND,
+         etl.WEATHER_API_URL, etl.SP500_HISTORY_URL) = original_settings
+        os.chdir(cwd)
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    return {
+        'total_wall_s': round(total, 4),
+        'peak_rss_mb': report['peak_rss_mb'],
+        'api_requests': server.snapshot()['requests'] if server is not None else session.requests,
+        'stages': {stage['stage']: {'wall_s': round(stage['wall_s'], 4), 'cpu_s': round(stage['cpu_s'], 4),
+                                    'rows_out': stage['rows_out']} for stage in report['stages']},
+        'retries': report.get('http'),
+    }
+
+def main():
+    """
+    Command-line entry point: generate datasets and/or run benchmarks, appending results as JSON lines.
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the ETL pipeline on synthetic Olist data")
+    parser.add_argument('--items', type=int, nargs='+', default=DEFAULT_SCALES, help="Order item counts to benchmark")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per scale")
+    parser.add_argument('--weather-latency', type=float, default=0.0, help="Simulated seconds per weather request")
+    parser.add_argument('--sp500-latency', type=float, default=0.0, help="Simulated seconds per S&P 500 call")
+    parser.add_argument('--weather-rps', type=float, default=BENCH_WEATHER_RPS, help="Weather request rate limit")
+    parser.add_argument('--streaming', action='store_true', help="Benchmark the streaming pipeline")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes for --streaming")
+    parser.add_argument('--http', action='store_true', help="Use a local mock HTTP server instead of in-process fakes")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of HTTP 500 responses (with --http)")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Share of HTTP 429 responses (with --http)")
+    parser.add_argument('--warm', action='store_true', help="Keep caches between runs")
+    parser.add_argument('--generate-only', action='store_true', help="Only generate the datasets")
+    parser.add_argument('--data-dir', default=BENCH_DATA_DIR)
+    parser.add_argument('--results', default=BENCH_RESULTS_FILE)
+    args = parser.parse_args()
+
+    revision = git_revision()
+    for n_items in args.items:
+        data_dir = os.path.abspath(os.path.join(args.data_dir, f"items_{n_items}_seed_{args.seed}"))
+        if not os.path.exists(os.path.join(data_dir, etl.OLIST_ORDER_ITEMS_CSV)):
+            logging.info(f"Generating synthetic Olist data ({n_items} items) in {data_dir}...")
+            counts = generate_synthetic_olist(data_dir, n_items, args.seed)
+            logging.info(f"Generated {counts}")
+        if args.generate_only:
+            continue
+        for run in range(args.repeat):
+            result = run_benchmark(data_dir, args.weather_latency, args.sp500_latency, args.streaming, args.warm,
+                                   args.weather_rps, args.http, args.error_rate, args.throttle_rate, args.workers)
+            result.update({
+                'commit': revision,
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'items': n_items,
+                'seed': args.seed,
+                'run': run,
+                'streaming': args.streaming,
+                'workers': args.workers,
+                'warm': args.warm,
+                'weather_latency': args.weather_latency,
+                'sp500_latency': args.sp500_latency,
+                'weather_rps': args.weather_rps,
+                'http': args.http,
+                'error_rate': args.error_rate,
+                'throttle_rate': args.throttle_rate,
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+            })
+            with open(args.results, 'a') as f:
+                f.write(json.dumps(result) + "\n")
+            logging.info(f"{n_items} items, run {run}: {result['total_wall_s']}s total")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,50 @@
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
 import yfinance as yf
 import requests
-from collections import defaultdict
 import unidecode
 import numpy as np
+import argparse
+import collections
+import contextlib
+import cProfile
+import functools
 import logging
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # Columnar cache is optional; fall back to pd.read_csv
+    pa = None
+
+try:
+    import psycopg2
+except ImportError:  # Only needed for the postgres sink
+    psycopg2 = None
+
+try:
+    import orjson
+except ImportError:  # Faster weather response decoding; falls back to response.json()
+    orjson = None
 
 # Setup basic logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -18,34 +56,362 @@ OLIST_ORDER_ITEMS_CSV = "olist_order_items_dataset.csv"
 OLIST_GEO_CSV = "olist_geolocation_dataset.csv"
 OLIST_CUSTOMERS_CSV = "olist_customers_dataset.csv"
 OUTPUT_CSV = "aggregated_seller_order_context.csv"
+OLIST_CACHE_DIR = ".olist_cache"  # Typed Parquet copies of the source CSVs; None disables
+GEO_DIMENSION_FILE = "geo_zip_dimension.arrow"  # Persisted zip-prefix dimension, stored inside OLIST_CACHE_DIR
+GEO_DIMENSION_VERSION = "1"  # Bump when the dimension's columns or aggregation change
+STREAM_SPILL_DIR = ".etl_spill"  # Scratch space for hash-partitioned orders/order_items
+STREAM_PARTITION_ROWS = 100_000  # Target order_items rows per order_id hash partition; the partition count grows with the input
+STREAM_CHUNK_ROWS = 500_000  # Rows read per CSV chunk while partitioning
+STREAM_WORKERS = 1  # Processes preparing and enriching streaming partitions; 1 runs them in the main process
+# Required output fields, in output column order
+OUTPUT_FIELDS = [
+    'order_id', 'seller_id', 'order_purchase_timestamp', 'order_delivered_customer_date',
+    'total_order_value', 'market_sentiment_on_purchase_date',
+    'delivery_location_latitude', 'delivery_location_longitude',
+    'delivery_date_mean_temp', 'delivery_date_precipitation_sum'
+]
+OUTPUT_KEY = ['order_id', 'seller_id']  # One output row per seller within an order; incremental merges upsert on it
+OUTPUT_SINK = "csv"  # Output sink: "csv" (legacy single file) or "parquet" (partitioned dataset)
+OUTPUT_PARQUET_DIR = "aggregated_seller_order_context_parquet"
+PARQUET_COMPRESSION = "zstd"
+PARQUET_ROW_GROUP_SIZE = 1_000_000
+PARQUET_SELLER_BUCKETS = None  # Optional extra seller_id hash partition level, e.g. 16
+POSTGRES_DSN = os.environ.get("POSTGRES_DSN")  # e.g. "host=localhost dbname=etl user=etl"
+POSTGRES_TABLE = "seller_order_enriched"
+POSTGRES_COPY_BATCH_ROWS = 100_000  # Rows per COPY FROM STDIN round trip
+ETL_STATE_FILE = "etl_state.json"  # Persisted high-water mark for incremental runs
+INCREMENTAL_LOOKBACK_DAYS = 3  # Reprocess this window before the watermark to catch late-arriving rows
+RUN_REPORT_JSON = "etl_run_report.json"  # Per-stage timing/memory report written after each run; None disables
+
+# Columns each downstream stage needs from each source file
+OLIST_STAGE_COLUMNS = {
+    OLIST_SELLERS_CSV: ['seller_id', 'seller_zip_code_prefix', 'seller_city', 'seller_state'],
+    OLIST_ORDERS_CSV: ['order_id', 'customer_id', 'order_status', 'order_purchase_timestamp', 'order_delivered_customer_date'],
+    OLIST_ORDER_ITEMS_CSV: ['order_id', 'order_item_id', 'product_id', 'seller_id', 'price', 'freight_value'],
+    OLIST_GEO_CSV: ['geolocation_zip_code_prefix', 'geolocation_lat', 'geolocation_lng', 'geolocation_city', 'geolocation_state'],
+    OLIST_CUSTOMERS_CSV: ['customer_id', 'customer_zip_code_prefix'],
+}
+OLIST_ID_COLUMNS = ['order_id', 'customer_id', 'customer_unique_id', 'seller_id', 'product_id', 'order_status']
+OLIST_ZIP_COLUMNS = ['seller_zip_code_prefix', 'geolocation_zip_code_prefix', 'customer_zip_code_prefix']
+OLIST_PRICE_COLUMNS = ['price', 'freight_value']
+ID_CATEGORICAL_MAX_RATIO = 0.5  # String IDs become categorical only below this distinct/rows ratio
+OLIST_INPUTS_SORTED = False  # Set when orders/order_items arrive sorted by order_id to use the sort-merge join
+PRICE_FIXED_POINT_SCALE = 100  # Prices are carried through the join as int32 cents when that round-trips exactly
+OLIST_TIMESTAMP_COLUMNS = [
+    'order_purchase_timestamp', 'order_approved_at', 'order_delivered_carrier_date',
+    'order_delivered_customer_date', 'order_estimated_delivery_date', 'shipping_limit_date'
+]
 
 SP500_TICKER = "^GSPC"
-WEATHER_API_URL = "https://archive-api.open-meteo.com/v1/archive"
+# Point these at mock_servers.py (e.g. http://localhost:8099/...) for offline or load testing
+WEATHER_API_URL = os.environ.get("WEATHER_API_URL", "https://archive-api.open-meteo.com/v1/archive")
+SP500_HISTORY_URL = os.environ.get("SP500_HISTORY_URL")  # Yahoo chart-style endpoint; unset uses yfinance
 TIMEZONE = 'America/Sao_Paulo'
+MARKET_DATA_DIR = ".market_data"  # Local store of fetched ticker closes; None always downloads the full range
+MARKET_ASOF_LOOKBACK_DAYS = 7  # Purchases use the latest close at most this many calendar days earlier
+MARKET_FINAL_AFTER_DAYS = 2  # Closes newer than this are refetched on the next run instead of marked as held
+WEATHER_CACHE_DB = "weather_cache.sqlite"  # Set to None to disable the on-disk weather cache
+WEATHER_CACHE_COMMIT_EVERY = 200  # Fetched location payloads written per cache transaction (one fsync each)
+WEATHER_FINAL_AFTER_DAYS = 7  # Archive values older than this are treated as final
+WEATHER_RECENT_TTL_HOURS = 24  # Refresh interval for provisional (recent) days
+WEATHER_GRID_RESOLUTION = 0.1  # Degrees (~11km, close to the reanalysis grid); None disables snapping
+WEATHER_MAX_WORKERS = 8  # Concurrent in-flight weather requests
+WEATHER_REQUESTS_PER_SECOND = 8  # Token-bucket rate in location-calls; a multi-location request costs one token per location (free tier allows 600/minute)
+WEATHER_RANGE_MERGE_GAP_DAYS = 30  # Break-even: one extra request costs about as much as this many unneeded days
+WEATHER_BATCH_MAX_LOCATIONS = 50  # Locations packed into one multi-location archive request
+HTTP_RETRY_ATTEMPTS = 4  # Attempts per request, including the first
+HTTP_RETRY_BASE_DELAY = 1.0  # Seconds; the backoff cap doubles each attempt and the sleep is drawn below it (full jitter)
+HTTP_RETRY_MAX_DELAY = 30.0  # Longest single sleep, including an honoured Retry-After
+HTTP_RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}  # Other 4xx/5xx responses fail without retrying
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive requests exhausting their retries on 5xx/connection errors that open a host's circuit
+CIRCUIT_RESET_SECONDS = 30  # An open circuit lets one trial request through after this long
+WEATHER_JOIN_KEYS = ['delivery_location_latitude', 'delivery_location_longitude', 'delivery_day_num']
+STRING_NORMALIZE_CACHE_SIZE = 100_000  # Distinct non-ASCII strings memoized by normalize_string
 VALID_LAT_RANGE = (-90, 90)
 VALID_LON_RANGE = (-180, 180)
+BRAZIL_LAT_RANGE = (-33.75, 5.27)
+BRAZIL_LON_RANGE = (-73.99, -34.79)
+# Optional region predicates applied on top of the lat/lon range checks.
+# Example: GEO_REGIONS = [bounding_box_region(BRAZIL_LAT_RANGE, BRAZIL_LON_RANGE)]
+GEO_REGIONS = []
+
+
+def peak_rss_mb():
+    """
+    Return the process peak resident set size so far.
+    Returns:
+        float: Peak RSS in megabytes (0.0 where the resource module is unavailable).
+    """
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def measure_rows_bytes(obj):
+    """
+    Estimate row count and in-memory size of a stage input or output.
+    Tuples are summed item by item; other sized objects only report rows.
+    Args:
+        obj (object): DataFrame, Series, array, mapping, sequence or tuple of these.
+    Returns:
+        tuple: (rows or None, bytes or None)
+    """
+    if isinstance(obj, pd.DataFrame):
+        return len(obj), int(obj.memory_usage(index=True, deep=False).sum())
+    if isinstance(obj, pd.Series):
+        return len(obj), int(obj.memory_usage(index=True, deep=False))
+    if isinstance(obj, np.ndarray):
+        return len(obj), int(obj.nbytes)
+    if isinstance(obj, tuple):
+        measured = [measure_rows_bytes(item) for item in obj]
+        rows = [r for r, _ in measured if r is not None]
+        sizes = [b for _, b in measured if b is not None]
+        return (sum(rows) if rows else None), (sum(sizes) if sizes else None)
+    if hasattr(obj, '__len__'):
+        return len(obj), None
+    return None, None
+
+class StageProfiler:
+    """
+    Records wall time, CPU time, peak RSS, rows and bytes for each pipeline stage and
+    writes them as a structured JSON run report. Top-level stages can additionally be
+    captured with cProfile (pstats format, viewable with snakeviz or pstats).
+    """
+
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.events = []
+        self.depth = 0
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    @contextlib.contextmanager
+    def stage(self, name, inputs=None):
+        """
+        Measure one execution of a stage. The yielded dict accepts an 'output' key.
+        Args:
+            name (str): Stage name.
+            inputs (object): Stage input used for rows/bytes in.
+        Yields:
+            dict: Mutable record; set record['output'] to report rows/bytes out.
+        """
+        rows_in, bytes_in = measure_rows_bytes(inputs) if inputs is not None else (None, None)
+        record = {'stage': name, 'depth': self.depth, 'rows_in': rows_in, 'bytes_in': bytes_in}
+        profiler = None
+        # cProfile cannot nest, so only top-level stages are captured
+        if self.profile_dir and self.depth == 0:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        rss_before = peak_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        self.depth += 1
+        try:
+            yield record
+        finally:
+            self.depth -= 1
+            record['wall_s'] = round(time.perf_counter() - wall_start, 4)
+            record['cpu_s'] = round(time.process_time() - cpu_start, 4)
+            record['peak_rss_mb'] = round(peak_rss_mb(), 1)
+            record['rss_growth_mb'] = round(record['peak_rss_mb'] - rss_before, 1)
+            output = record.pop('output', None)
+            record['rows_out'], record['bytes_out'] = measure_rows_bytes(output) if output is not None else (None, None)
+            if profiler is not None:
+                profiler.disable()
+                count = sum(1 for event in self.events if event['stage'] == name)
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{name}-{count:03d}.prof"))
+            self.events.append(record)
+            logging.info(f"Stage {name}: {record['wall_s']}s wall, {record['cpu_s']}s CPU, peak RSS {record['peak_rss_mb']} MB")
+
+    def report(self):
+        """
+        Build the run report, aggregating repeated stages (e.g. streaming partitions).
+        Returns:
+            dict: Run report with per-stage totals and the raw events.
+        """
+        stages = {}
+        for event in self.events:
+            total = stages.setdefault(event['stage'], {
+                'stage': event['stage'], 'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                'peak_rss_mb': 0.0, 'rows_in': 0, 'rows_out': 0, 'bytes_in': 0, 'bytes_out': 0
+            })
+            total['calls'] += 1
+            total['peak_rss_mb'] = max(total['peak_rss_mb'], event['peak_rss_mb'])
+            for key in ['wall_s', 'cpu_s', 'rows_in', 'rows_out', 'bytes_in', 'bytes_out']:
+                total[key] += event[key] or 0
+        return {
+            'started_at': self.started_at.isoformat(),
+            'total_wall_s': round(time.perf_counter() - self.started, 4),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'stages': list(stages.values()),
+            'http': retry_metrics.snapshot(),
+            'events': self.events,
+        }
+
+    def write_report(self, path=RUN_REPORT_JSON):
+        """
+        Write the run report as JSON.
+        Args:
+            path (str): Report file path.
+        Returns:
+            None
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+_active_profiler = None
+
+@contextlib.contextmanager
+def profile_stage(name, inputs=None):
+    """
+    Measure a block as a stage of the active StageProfiler (no-op when profiling is off).
+    Args:
+        name (str): Stage name.
+        inputs (object): Stage input used for rows/bytes in.
+    Yields:
+        dict: Mutable stage record.
+    """
+    if _active_profiler is None:
+        yield {}
+        return
+    with _active_profiler.stage(name, inputs) as record:
+        yield record
 
+def profiled(name):
+    """
+    Decorator measuring every call of a function as a pipeline stage.
+    Positional arguments are the stage input and the return value its output.
+    Args:
+        name (str): Stage name.
+    Returns:
+        callable: Decorator.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile_stage(name, args[0] if len(args) == 1 else args or None) as record:
+                result = func(*args, **kwargs)
+                record['output'] = result
+            return result
+        return wrapper
+    return decorator
+
+def bounding_box_region(lat_range, lon_range):
+    """
+    Build a vectorized region predicate for a lat/lon bounding box.
+    Args:
+        lat_range (tuple): (min_lat, max_lat) bounds, inclusive.
+        lon_range (tuple): (min_lon, max_lon) bounds, inclusive.
+    Returns:
+        callable: Function (lat, lon) -> np.ndarray of bool.
+    """
+    def contains(lat, lon):
+        return (lat >= lat_range[0]) & (lat <= lat_range[1]) & (lon >= lon_range[0]) & (lon <= lon_range[1])
+    return contains
+
+def polygon_region(vertices):
+    """
+    Build a vectorized region predicate for a polygon using ray casting.
+    Args:
+        vertices (list): List of (lat, lon) tuples describing the polygon boundary.
+    Returns:
+        callable: Function (lat, lon) -> np.ndarray of bool.
+    """
+    poly = np.asarray(vertices, dtype=float)
+
+    def contains(lat, lon):
+        inside = np.zeros(len(lat), dtype=bool)
+        j = len(poly) - 1
+        # Loop over polygon edges only; each edge test is vectorized over all points
+        for i in range(len(poly)):
+            lat_i, lon_i = poly[i]
+            lat_j, lon_j = poly[j]
+            crosses = (lat_i > lat) != (lat_j > lat)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                lon_cross = (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i
+            inside ^= crosses & (lon < lon_cross)
+            j = i
+        return inside
+    return contains
+
+def validate_coordinate_arrays(lat, lon, regions=None):
+    """
+    Vectorized coordinate validation over lat/lon arrays.
+    Args:
+        lat (array-like): Latitude values.
+        lon (array-like): Longitude values.
+        regions (list): Optional region predicates; a point must fall inside at least one of them.
+    Returns:
+        tuple: (np.ndarray of bool validity mask, dict of rejection counts per rule)
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    regions = GEO_REGIONS if regions is None else regions
+
+    # Each rule only counts rows that survived the previous rules
+    rules = [
+        ('missing', lambda: ~(np.isnan(lat) | np.isnan(lon))),
+        ('lat_range', lambda: (lat >= VALID_LAT_RANGE[0]) & (lat <= VALID_LAT_RANGE[1])),
+        ('lon_range', lambda: (lon >= VALID_LON_RANGE[0]) & (lon <= VALID_LON_RANGE[1])),
+    ]
+    if regions:
+        rules.append(('region', lambda: np.logical_or.reduce([region(lat, lon) for region in regions])))
+
+    mask = np.ones(len(lat), dtype=bool)
+    rejections = {}
+    for name, rule in rules:
+        passed = rule()
+        rejections[name] = int((mask & ~passed).sum())
+        mask &= passed
+    return mask, rejections
+
+def filter_valid_coordinates(df, lat_col, lon_col, regions=None):
+    """
+    Keep only rows with valid coordinates and log per-rule rejection counts.
+    Args:
+        df (pd.DataFrame): Dataframe with coordinate columns.
+        lat_col (str): Name of the latitude column.
+        lon_col (str): Name of the longitude column.
+        regions (list): Optional region predicates (defaults to GEO_REGIONS).
+    Returns:
+        pd.DataFrame: Filtered dataframe.
+    """
+    mask, rejections = validate_coordinate_arrays(df[lat_col].to_numpy(), df[lon_col].to_numpy(), regions)
+    if any(rejections.values()):
+        logging.info(f"Coordinate rejections: {rejections}")
+    return df[mask]
 
-def validate_coordinates(lat, lon):
+@functools.lru_cache(maxsize=STRING_NORMALIZE_CACHE_SIZE)
+def normalize_string(value):
     """
-    Validate latitude and longitude ranges.
+    Remove accents, lowercase and strip a single string. Memoized process-wide, so
+    values repeated across datasets (e.g. seller and geolocation cities) are transliterated once.
     Args:
-        lat (float): Latitude value.
-        lon (float): Longitude value.
+        value (str): Raw string.
     Returns:
-        bool: True if coordinates are within valid ranges, False otherwise.
+        str: Normalized string.
     """
-    return VALID_LAT_RANGE[0] <= lat <= VALID_LAT_RANGE[1] and VALID_LON_RANGE[0] <= lon <= VALID_LON_RANGE[1]
+    return unidecode.unidecode(value).lower().strip()
 
 def clean_string_column(series):
     """
     Clean string columns: remove accents, lowercase, strip whitespace.
+    The column is factorized so each distinct value is normalized once and broadcast back
+    through the codes; pure-ASCII values skip unidecode entirely.
     Args:
         series (pd.Series): Pandas Series of strings.
     Returns:
         pd.Series: Cleaned string series.
     """
-    return series.apply(lambda x: unidecode.unidecode(str(x)).lower().strip())
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    normalized = np.array(
+        [value.lower().strip() if value.isascii() else normalize_string(value) for value in map(str, uniques)],
+        dtype=object
+    )
+    return pd.Series(normalized[codes], index=series.index, name=series.name)
 
 def clean_raw_data(df, file_name):
     """
@@ -83,35 +449,296 @@ def clean_raw_data(df, file_name):
         cleaned_df['geolocation_city'] = clean_string_column(cleaned_df['geolocation_city'])
         cleaned_df = cleaned_df.dropna(subset=['geolocation_zip_code_prefix', 'geolocation_lat', 'geolocation_lng'])
         # Validate coordinates
-        cleaned_df = cleaned_df[cleaned_df.apply(lambda x: validate_coordinates(x['geolocation_lat'], x['geolocation_lng']), axis=1)]
+        cleaned_df = filter_valid_coordinates(cleaned_df, 'geolocation_lat', 'geolocation_lng')
 
     logging.info(f"Cleaned {initial_rows} → {len(cleaned_df)} rows")
     return cleaned_df
 
+def file_fingerprint(path):
+    """
+    Compute a SHA-256 checksum of a file, streaming it in blocks.
+    Args:
+        path (str): File path.
+    Returns:
+        str: Hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_metadata(csv_path):
+    """
+    Describe a source file for staleness checks of artifacts derived from it.
+    Args:
+        csv_path (str): Source file path.
+    Returns:
+        dict: Schema metadata entries (bytes keys and values).
+    """
+    stat = os.stat(csv_path)
+    return {
+        b'source_mtime': str(stat.st_mtime_ns).encode(),
+        b'source_size': str(stat.st_size).encode(),
+        b'source_sha256': file_fingerprint(csv_path).encode(),
+    }
+
+def source_is_unchanged(csv_path, metadata, artifact_path):
+    """
+    Check a derived artifact's recorded source metadata against the current source file.
+    The cheap mtime/size check is tried first; the checksum only when those differ. When the
+    checksum still matches (after a touch, checkout or copy), the new mtime/size are recorded in
+    a sidecar next to the artifact so later runs skip the checksum again.
+    Args:
+        csv_path (str): Source file path.
+        metadata (dict): Schema metadata written from source_metadata.
+        artifact_path (str): Derived artifact path (the sidecar is artifact_path + '.source.json').
+    Returns:
+        bool: True if the source has not changed.
+    """
+    stat = os.stat(csv_path)
+    current = {b'source_mtime': str(stat.st_mtime_ns).encode(), b'source_size': str(stat.st_size).encode()}
+    recorded = [metadata]
+    sidecar_path = artifact_path + '.source.json'
+    if os.path.exists(sidecar_path):
+        with open(sidecar_path) as f:
+            sidecar = {key.encode(): value.encode() for key, value in json.load(f).items()}
+        # A sidecar only vouches for the source version the artifact was built from
+        if sidecar.get(b'source_sha256') == metadata.get(b'source_sha256'):
+            recorded.append(sidecar)
+    if any(all(entry.get(key) == value for key, value in current.items()) for entry in recorded):
+        return True
+    if metadata.get(b'source_sha256') != file_fingerprint(csv_path).encode():
+        return False
+    tmp_path = sidecar_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'source_mtime': current[b'source_mtime'].decode(), 'source_size': current[b'source_size'].decode(),
+                   'source_sha256': metadata[b'source_sha256'].decode()}, f)
+    os.replace(tmp_path, sidecar_path)
+    return True
+
+def build_columnar_cache(csv_path, parquet_path):
+    """
+    Convert an Olist CSV into a typed Parquet file using the pyarrow CSV reader.
+    IDs are dictionary-encoded, zip prefixes kept as strings and timestamps parsed natively.
+    Args:
+        csv_path (str): Source CSV path.
+        parquet_path (str): Destination Parquet path.
+    Returns:
+        None
+    """
+    header = pd.read_csv(csv_path, nrows=0).columns
+    column_types = {}
+    for col in header:
+        if col in OLIST_ID_COLUMNS:
+            column_types[col] = pa.dictionary(pa.int32(), pa.string())
+        elif col in OLIST_ZIP_COLUMNS:
+            column_types[col] = pa.string()
+        elif col in OLIST_TIMESTAMP_COLUMNS:
+            column_types[col] = pa.timestamp('ns')
+    table = pa_csv.read_csv(
+        csv_path,
+        convert_options=pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=True)
+    )
+    metadata = dict(table.schema.metadata or {})
+    metadata.update(source_metadata(csv_path))
+    # Write to a temp file first so an interrupted run never leaves a truncated cache
+    tmp_path = parquet_path + '.tmp'
+    pq.write_table(table.replace_schema_metadata(metadata), tmp_path, compression='zstd')
+    os.replace(tmp_path, parquet_path)
+
+def columnar_cache_is_fresh(csv_path, parquet_path):
+    """
+    Check whether a Parquet cache still matches its source CSV.
+    Args:
+        csv_path (str): Source CSV path.
+        parquet_path (str): Cached Parquet path.
+    Returns:
+        bool: True if the cache can be reused.
+    """
+    if not os.path.exists(parquet_path):
+        return False
+    return source_is_unchanged(csv_path, pq.read_schema(parquet_path).metadata or {}, parquet_path)
+
+def read_olist_table(csv_path, columns=None):
+    """
+    Read an Olist dataset, going through the typed Parquet cache when pyarrow is available.
+    Args:
+        csv_path (str): Source CSV path.
+        columns (list): Columns to read. Defaults to all columns.
+    Returns:
+        pd.DataFrame: Loaded dataframe.
+    """
+    if pa is None or OLIST_CACHE_DIR is None:
+        header = pd.read_csv(csv_path, nrows=0).columns
+        usecols = columns or list(header)
+        return pd.read_csv(
+            csv_path,
+            usecols=usecols,
+            dtype={col: 'string' for col in OLIST_ZIP_COLUMNS if col in usecols},
+            parse_dates=[col for col in OLIST_TIMESTAMP_COLUMNS if col in usecols]
+        )
+
+    os.makedirs(OLIST_CACHE_DIR, exist_ok=True)
+    parquet_path = os.path.join(OLIST_CACHE_DIR, os.path.splitext(os.path.basename(csv_path))[0] + '.parquet')
+    if not columnar_cache_is_fresh(csv_path, parquet_path):
+        logging.info(f"Building columnar cache for {csv_path}...")
+        build_columnar_cache(csv_path, parquet_path)
+    df = pq.read_table(parquet_path, columns=columns).to_pandas()
+    # Sort categories so groupby/sort order matches plain string IDs
+    for col in df.select_dtypes('category').columns:
+        df[col] = df[col].cat.reorder_categories(df[col].cat.categories.sort_values())
+    return df
+
+def frame_memory_mb(*frames):
+    """
+    Deep in-memory size of one or more dataframes.
+    Args:
+        *frames (pd.DataFrame): Dataframes to measure.
+    Returns:
+        float: Total size in MB.
+    """
+    return sum(int(df.memory_usage(index=True, deep=True).sum()) for df in frames) / 1e6
+
+def compact_id_columns(columns):
+    """
+    Give the same ID drawn from several frames one compact, merge-friendly dtype.
+    Categorical inputs (from the columnar cache) are aligned to one sorted category set so merges
+    compare integer codes and groupby order matches plain string IDs. Plain string IDs become
+    categorical only when repeated enough for the codes to pay off; near-unique IDs like order_id
+    are smaller as strings than as categories plus codes. The ratio is taken against the largest
+    frame, since an ID that is unique in one frame (order_id in orders) stays near-unique overall.
+    Args:
+        columns (list): pd.Series of the same ID drawn from different frames.
+    Returns:
+        list: Compacted pd.Series, in input order.
+    """
+    first = columns[0]
+    is_categorical = [isinstance(s.dtype, pd.CategoricalDtype) for s in columns]
+    if all(is_categorical) and all(s.cat.categories.equals(first.cat.categories) for s in columns[1:]):
+        # Columns read from the same-shaped cache files often already share their dictionary
+        return [s.astype(first.dtype) for s in columns]
+    values = [
+        np.asarray(s.cat.categories if categorical else s.dropna().unique(), dtype=object)
+        for s, categorical in zip(columns, is_categorical)
+    ]
+    categories = pd.Index(np.concatenate(values)).unique()
+    if not any(is_categorical) and len(categories) > ID_CATEGORICAL_MAX_RATIO * max(len(s) for s in columns):
+        return list(columns)
+    dtype = pd.CategoricalDtype(categories.sort_values())
+    return [s.astype(dtype) for s in columns]
+
+def encode_fixed_point(series, scale=PRICE_FIXED_POINT_SCALE):
+    """
+    Encode a decimal column as int32 fixed point if decoding reproduces every float64 value exactly.
+    Args:
+        series (pd.Series): Float column, e.g. prices with two decimals.
+        scale (int): Fixed-point scale (100 stores cents).
+    Returns:
+        pd.Series or None: Encoded column, or None if the encoding would lose precision.
+    """
+    values = series.to_numpy(dtype=np.float64)
+    scaled = np.round(values * scale)
+    if not len(values) or not np.isfinite(scaled).all() or np.abs(scaled).max() > np.iinfo(np.int32).max:
+        return None
+    encoded = scaled.astype(np.int32)
+    # Division is correctly rounded, so this holds for every value parsed from a short decimal
+    if not np.array_equal(encoded / scale, values):
+        return None
+    return pd.Series(encoded, index=series.index, name=series.name)
+
+def fixed_point_values(df, col, scale=PRICE_FIXED_POINT_SCALE):
+    """
+    Read a price column as float64, decoding its fixed-point form if compact_olist_frames produced one.
+    Args:
+        df (pd.DataFrame): Frame holding either col or col + '_fp'.
+        col (str): Price column name.
+        scale (int): Fixed-point scale used for encoding.
+    Returns:
+        pd.Series: float64 values identical to the original column.
+    """
+    if col + '_fp' in df.columns:
+        return df[col + '_fp'] / scale
+    return df[col]
+
+def compact_olist_frames(orders, order_items, customers=None):
+    """
+    Drop the columns the pipeline no longer needs after cleaning and shrink dtypes without
+    changing any value: IDs shared between frames get one compact dtype (see compact_id_columns)
+    and prices become int32 fixed point where lossless. Logs the before/after deep memory footprint.
+    Args:
+        orders (pd.DataFrame): Cleaned orders dataframe.
+        order_items (pd.DataFrame): Cleaned order_items dataframe.
+        customers (pd.DataFrame): Cleaned customers dataframe; None leaves customer IDs as they are.
+    Returns:
+        tuple: Compacted (orders, order_items, customers).
+    """
+    frames = [df for df in (orders, order_items, customers) if df is not None]
+    before_mb = frame_memory_mb(*frames)
+    order_ids = compact_id_columns([orders['order_id'], order_items['order_id']])
+    (seller_ids,) = compact_id_columns([order_items['seller_id']])
+    orders = orders[['order_id', 'customer_id', 'order_purchase_timestamp', 'order_delivered_customer_date']] \
+        .assign(order_id=order_ids[0])
+    if customers is not None:
+        customer_ids = compact_id_columns([orders['customer_id'], customers['customer_id']])
+        orders = orders.assign(customer_id=customer_ids[0])
+        customers = customers[['customer_id', 'customer_zip_code_prefix']].assign(customer_id=customer_ids[1])
+
+    compact_items = {'order_id': order_ids[1], 'seller_id': seller_ids}
+    for col in OLIST_PRICE_COLUMNS:
+        encoded = encode_fixed_point(order_items[col])
+        if encoded is None:
+            compact_items[col] = order_items[col]
+        else:
+            compact_items[col + '_fp'] = encoded
+    order_items = pd.DataFrame(compact_items)
+
+    after_mb = frame_memory_mb(*[df for df in (orders, order_items, customers) if df is not None])
+    logging.info(f"Compacted orders/order_items{'/customers' if customers is not None else ''}: "
+                 f"{before_mb:.1f} MB → {after_mb:.1f} MB")
+    return orders, order_items, customers
+
+@profiled('load_olist_data')
 def load_olist_data():
     """
     Load and validate all Olist datasets, including customers.
+    Only the columns used downstream (OLIST_STAGE_COLUMNS) are read. Geolocations are served
+    by the persisted zip-prefix dimension (see load_geo_dimension).
     Returns:
-        tuple: sellers, orders, order_items, geolocations, customers (all pd.DataFrame)
+        tuple: sellers, orders, order_items, customers (all pd.DataFrame)
     """
-    dtype_map = {'seller_zip_code_prefix': 'string', 'geolocation_zip_code_prefix': 'string', 'customer_zip_code_prefix': 'string'}
-    
     # Load each dataset
-    sellers = pd.read_csv(OLIST_SELLERS_CSV, dtype=dtype_map)
-    orders = pd.read_csv(OLIST_ORDERS_CSV, parse_dates=['order_purchase_timestamp', 'order_delivered_customer_date'])
-    order_items = pd.read_csv(OLIST_ORDER_ITEMS_CSV)
-    geolocations = pd.read_csv(OLIST_GEO_CSV, dtype=dtype_map)
-    customers = pd.read_csv(OLIST_CUSTOMERS_CSV, dtype=dtype_map)
+    sellers = read_olist_table(OLIST_SELLERS_CSV, OLIST_STAGE_COLUMNS[OLIST_SELLERS_CSV])
+    orders = read_olist_table(OLIST_ORDERS_CSV, OLIST_STAGE_COLUMNS[OLIST_ORDERS_CSV])
+    order_items = read_olist_table(OLIST_ORDER_ITEMS_CSV, OLIST_STAGE_COLUMNS[OLIST_ORDER_ITEMS_CSV])
+    customers = read_olist_table(OLIST_CUSTOMERS_CSV, OLIST_STAGE_COLUMNS[OLIST_CUSTOMERS_CSV])
     
     # Clean each dataset
     sellers = clean_raw_data(sellers, 'sellers')
     orders = clean_raw_data(orders, 'orders')
     order_items = clean_raw_data(order_items, 'order_items')
-    geolocations = clean_raw_data(geolocations, 'geolocations')
     
     # Drop customers with missing zip code
     customers = customers.dropna(subset=['customer_id', 'customer_zip_code_prefix'])
-    return sellers, orders, order_items, geolocations, customers
+    # Shrink IDs and prices before the joins; the wide cleaned frames are released here
+    orders, order_items, customers = compact_olist_frames(orders, order_items, customers)
+    return sellers, orders, order_items, customers
+
+def aggregate_geolocations(geolocations):
+    """
+    Average coordinates per zip prefix, keeping the first city/state and the sample count.
+    Args:
+        geolocations (pd.DataFrame): Cleaned geolocations dataframe.
+    Returns:
+        pd.DataFrame: One row per zip prefix, sorted by prefix.
+    """
+    return geolocations.groupby('geolocation_zip_code_prefix', observed=True).agg(
+        geolocation_lat=('geolocation_lat', 'mean'),
+        geolocation_lng=('geolocation_lng', 'mean'),
+        geolocation_city=('geolocation_city', 'first'),
+        geolocation_state=('geolocation_state', 'first'),
+        sample_count=('geolocation_lat', 'size')
+    ).reset_index()
 
 def process_geolocations(geolocations):
     """
@@ -121,54 +748,190 @@ def process_geolocations(geolocations):
     Returns:
         pd.DataFrame: Processed geolocations with valid averaged coordinates.
     """
-    # Group by zip prefix and average lat/lon
-    geo_processed = geolocations.groupby('geolocation_zip_code_prefix').agg({
-        'geolocation_lat': 'mean',
-        'geolocation_lng': 'mean',
-        'geolocation_city': 'first',
-        'geolocation_state': 'first'
-    }).reset_index()
-   
     # Keep only valid coordinates
-    return geo_processed[geo_processed.apply(lambda x: validate_coordinates(x['geolocation_lat'], x['geolocation_lng']), axis=1)]
+    return filter_valid_coordinates(aggregate_geolocations(geolocations), 'geolocation_lat', 'geolocation_lng')
+
+def build_geo_dimension(dimension_path):
+    """
+    Aggregate the geolocation file into the zip-prefix dimension and persist it as an
+    uncompressed Arrow IPC file sorted by prefix, stamped with the source fingerprint.
+    Args:
+        dimension_path (str): Destination file path.
+    Returns:
+        None
+    """
+    geolocations = clean_raw_data(read_olist_table(OLIST_GEO_CSV, OLIST_STAGE_COLUMNS[OLIST_GEO_CSV]), 'geolocations')
+    dimension = aggregate_geolocations(geolocations)
+    dimension['geolocation_zip_code_prefix'] = dimension['geolocation_zip_code_prefix'].astype(str)
+    table = pa.Table.from_pandas(dimension.sort_values('geolocation_zip_code_prefix'), preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata.update(source_metadata(OLIST_GEO_CSV))
+    metadata[b'dimension_version'] = GEO_DIMENSION_VERSION.encode()
+    table = table.replace_schema_metadata(metadata)
+    tmp_path = dimension_path + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, dimension_path)
+
+def geo_dimension_is_fresh(dimension_path):
+    """
+    Check whether the persisted dimension matches the current geolocation file and version.
+    Args:
+        dimension_path (str): Dimension file path.
+    Returns:
+        bool: True if the dimension can be reused.
+    """
+    if not os.path.exists(dimension_path):
+        return False
+    with pa.memory_map(dimension_path) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    if metadata.get(b'dimension_version') != GEO_DIMENSION_VERSION.encode():
+        return False
+    return source_is_unchanged(OLIST_GEO_CSV, metadata, dimension_path)
+
+@profiled('process_geolocations')
+def load_geo_dimension():
+    """
+    Load the validated zip-prefix → coordinate dimension, rebuilding the persisted copy only
+    when the geolocation file changed. Without pyarrow or a cache dir it is aggregated in memory.
+    Returns:
+        pd.DataFrame: Valid averaged coordinates per zip prefix, sorted by prefix.
+    """
+    if pa is None or OLIST_CACHE_DIR is None:
+        geolocations = clean_raw_data(read_olist_table(OLIST_GEO_CSV, OLIST_STAGE_COLUMNS[OLIST_GEO_CSV]), 'geolocations')
+        return process_geolocations(geolocations)
+
+    os.makedirs(OLIST_CACHE_DIR, exist_ok=True)
+    dimension_path = os.path.join(OLIST_CACHE_DIR, GEO_DIMENSION_FILE)
+    if not geo_dimension_is_fresh(dimension_path):
+        logging.info(f"Building zip-prefix dimension from {OLIST_GEO_CSV}...")
+        build_geo_dimension(dimension_path)
+    # The file is uncompressed Arrow, so it is read straight from the memory map
+    with pa.memory_map(dimension_path) as source:
+        dimension = pa.ipc.open_file(source).read_all().to_pandas()
+    # Validation runs on load so rule changes never require a rebuild
+    return filter_valid_coordinates(dimension, 'geolocation_lat', 'geolocation_lng')
+
+def lookup_zip_coordinates(zip_prefixes, geo_dimension):
+    """
+    Look up averaged coordinates by binary search over the sorted dimension.
+    Each distinct prefix is searched once and fanned back out through its factor codes.
+    Args:
+        zip_prefixes (pd.Series): Zip prefixes to look up (may contain missing values).
+        geo_dimension (pd.DataFrame): Dimension sorted by geolocation_zip_code_prefix.
+    Returns:
+        tuple: (latitudes, longitudes) as np.ndarray, NaN where the prefix is unknown.
+    """
+    keys = geo_dimension['geolocation_zip_code_prefix'].to_numpy(dtype=object)
+    codes, uniques = pd.factorize(zip_prefixes)
+    uniques = np.asarray(uniques, dtype=object)
+    pos = np.searchsorted(keys, uniques).clip(max=max(len(keys) - 1, 0))
+    found = keys[pos] == uniques if len(keys) else np.zeros(len(uniques), dtype=bool)
+    coordinates = []
+    for col in ['geolocation_lat', 'geolocation_lng']:
+        # Trailing NaN slot is picked up by the -1 code of missing prefixes
+        values = np.full(len(uniques) + 1, np.nan)
+        values[:-1][found] = geo_dimension[col].to_numpy(dtype=np.float64)[pos[found]]
+        coordinates.append(values[codes])
+    return tuple(coordinates)
+
+def shared_id_codes(left, right):
+    """
+    Integer codes for the same ID in two frames, ordered like the sorted ID strings.
+    Args:
+        left (pd.Series): ID column of the first frame.
+        right (pd.Series): ID column of the second frame.
+    Returns:
+        tuple: (left codes, right codes, number of codes); missing IDs get -1.
+    """
+    if isinstance(left.dtype, pd.CategoricalDtype) and left.dtype == right.dtype:
+        # compact_olist_frames already gave both sides one sorted dictionary
+        return left.cat.codes.to_numpy(np.int64), right.cat.codes.to_numpy(np.int64), len(left.cat.categories)
+    codes, uniques = pd.factorize(pd.concat([left, right], ignore_index=True), sort=True)
+    codes = codes.astype(np.int64)
+    return codes[:len(left)], codes[len(left):], len(uniques)
+
+def aggregate_order_items(order_codes, item_codes, seller_codes, n_sellers, item_totals, presorted=False):
+    """
+    Sum item totals per (order, seller) on integer keys and match each group to its order row.
+    The hash path addresses orders through a dense code → row table; the sort-merge path
+    binary-searches orders already sorted by code and needs no table or sort.
+    Args:
+        order_codes (np.ndarray): Order ID code of each order row (unique).
+        item_codes (np.ndarray): Order ID code of each item row.
+        seller_codes (np.ndarray): Seller code of each item row.
+        n_sellers (int): Number of seller codes.
+        item_totals (pd.Series): Price plus freight of each item row.
+        presorted (bool): Orders and items are sorted by order code (items also by seller within an order).
+    Returns:
+        tuple: (order row per group, seller code per group, group totals as np.ndarray), ordered by (order, seller).
+    """
+    if presorted:
+        def rows_for(codes):
+            rows = np.searchsorted(order_codes, codes).clip(max=max(len(order_codes) - 1, 0))
+            found = (codes >= 0) & (order_codes[rows] == codes) if len(order_codes) else np.zeros(len(codes), dtype=bool)
+            return np.where(found, rows, -1)
+    else:
+        n_codes = max(order_codes.max(initial=-1), item_codes.max(initial=-1)) + 1
+        code_rows = np.full(n_codes + 1, -1, dtype=np.int64)
+        code_rows[order_codes] = np.arange(len(order_codes))
+        # Code -1 (missing ID) lands on the trailing -1 slot
+        rows_for = code_rows.__getitem__
 
-def join_olist_data(sellers, orders, order_items, geo_processed, customers):
+    matched = rows_for(item_codes) >= 0
+    # One int64 key per (order, seller); its order is the (order_id, seller_id) sort order
+    keys = item_codes[matched] * n_sellers + seller_codes[matched]
+    totals = item_totals[matched].groupby(keys, sort=not presorted).sum()
+    group_keys = totals.index.to_numpy()
+    return rows_for(group_keys // n_sellers), group_keys % n_sellers, totals.to_numpy()
+
+@profiled('join_olist_data')
+def join_olist_data(sellers, orders, order_items, geo_processed, customers, presorted=None):
     """
     Join Olist datasets to link sellers to their orders and items, and orders to customer geolocation.
+    Items are aggregated per (order, seller) on integer keys; order-level attributes are then
+    attached one-to-one by row position instead of being carried through a wide groupby.
     Args:
         sellers (pd.DataFrame): Cleaned sellers dataframe.
         orders (pd.DataFrame): Cleaned orders dataframe.
         order_items (pd.DataFrame): Cleaned order_items dataframe.
-        geo_processed (pd.DataFrame): Processed geolocations dataframe.
+        geo_processed (pd.DataFrame): Zip-prefix dimension from load_geo_dimension.
         customers (pd.DataFrame): Cleaned customers dataframe.
+        presorted (bool): Use the sort-merge path (defaults to OLIST_INPUTS_SORTED); inputs are
+            checked and the hash path is used if they are not actually sorted.
     Returns:
         pd.DataFrame: Joined dataframe with customer-based geolocation for each order.
     """
-    # Merge order_items with orders to get customer_id and timestamps
-    orders_items = pd.merge(
-        order_items,
-        orders[['order_id', 'customer_id', 'order_purchase_timestamp', 'order_delivered_customer_date']],
-        on='order_id',
-        how='inner'
+    presorted = OLIST_INPUTS_SORTED if presorted is None else presorted
+    # Integer codes for order and seller IDs, ranked like the ID strings
+    order_codes, item_codes, _ = shared_id_codes(orders['order_id'], order_items['order_id'])
+    seller_codes, seller_ids = pd.factorize(order_items['seller_id'], sort=True)
+    seller_codes = seller_codes.astype(np.int64)
+    if presorted:
+        item_keys = item_codes * len(seller_ids) + seller_codes
+        presorted = bool((np.diff(order_codes) > 0).all() and (np.diff(item_keys) >= 0).all())
+        if not presorted:
+            logging.warning("Inputs are not sorted by order_id; using the hash join")
+
+    # Calculate total price per item (decoded back to float64 so sums match the raw prices exactly)
+    item_totals = fixed_point_values(order_items, 'price') + fixed_point_values(order_items, 'freight_value')
+    # Aggregate at order and seller level
+    group_rows, group_sellers, group_totals = aggregate_order_items(
+        order_codes, item_codes, seller_codes, len(seller_ids), item_totals.reset_index(drop=True), presorted
     )
-    # Calculate total price per item
-    orders_items['total_price'] = orders_items['price'] + orders_items['freight_value']
-    # Aggregate at order, seller, customer, and date level
-    order_agg = orders_items.groupby(
-        ['order_id', 'seller_id', 'customer_id', 'order_purchase_timestamp', 'order_delivered_customer_date'],
-        as_index=False
-    ).agg(total_order_value=('total_price', 'sum'))
+    # Attach order-level attributes one-to-one by order row
+    order_attrs = orders[['order_id', 'customer_id', 'order_purchase_timestamp', 'order_delivered_customer_date']]
+    order_agg = order_attrs.iloc[group_rows].reset_index(drop=True)
+    order_agg.insert(1, 'seller_id', seller_ids.take(group_sellers))
+    order_agg['total_order_value'] = group_totals
+    # Drop groups whose order-level keys are missing, as a groupby on them would
+    order_agg = order_agg.dropna(subset=['customer_id'])
     
     # Join with customers to get customer_zip_code_prefix
     result = pd.merge(order_agg, customers[['customer_id', 'customer_zip_code_prefix']], on='customer_id', how='left')
-    # Join with geolocations using customer_zip_code_prefix
-    result = pd.merge(result, geo_processed, left_on='customer_zip_code_prefix', right_on='geolocation_zip_code_prefix', how='left')
-    
-    # Rename columns for clarity
-    result = result.rename(columns={
-        'geolocation_lat': 'delivery_location_latitude',
-        'geolocation_lng': 'delivery_location_longitude'
-    })
+    # Look up delivery coordinates in the zip-prefix dimension using customer_zip_code_prefix
+    result['delivery_location_latitude'], result['delivery_location_longitude'] = \
+        lookup_zip_coordinates(result['customer_zip_code_prefix'], geo_processed)
     # Drop rows with missing required columns
     required_cols = [
         'order_id', 'seller_id', 'order_purchase_timestamp',
@@ -178,113 +941,982 @@ def join_olist_data(sellers, orders, order_items, geo_processed, customers):
     
     return result.dropna(subset=required_cols)[required_cols]
 
-def batch_fetch_sp500(dates):
+def fetch_sp500_history(start_date, end_date):
     """
-    Batch fetch S&P 500 closing prices for a list of dates using yfinance.
+    Fetch daily S&P 500 closes, from SP500_HISTORY_URL if configured, otherwise via yfinance.
     Args:
-        dates (list or np.ndarray): List of date strings (YYYY-MM-DD) to fetch prices for.
+        start_date (str or datetime): First date (inclusive).
+        end_date (str or datetime): Last date (exclusive).
     Returns:
-        dict: Mapping from date string to closing price (float). Missing dates are filled with last available price.
+        pd.Series: Closing prices indexed by tz-aware trading dates.
     """
-    try:
-        # Initialize yfinance Ticker object
-        sp500 = yf.Ticker(SP500_TICKER)
-        start_date = min(dates)
-        end_date = max(dates)
-       
-        # Fetch historical data for the date range
-        history = sp500.history(start=start_date, end=datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1), interval='1d')
+    if not SP500_HISTORY_URL:
+        history = yf.Ticker(SP500_TICKER).history(start=start_date, end=end_date, interval='1d')
         if history.empty:
-            return {}
+            # yfinance reports transient failures as an empty frame; raise so the range is not recorded as held
+            if np.busday_count(pd.Timestamp(start_date).date(), pd.Timestamp(end_date).date()) > 0:
+                raise RuntimeError(f"yfinance returned no S&P 500 history for {start_date} to {end_date}")
+            return pd.Series(dtype=float)
+        return history['Close']
+
+    # Yahoo chart API layout: epoch-second timestamps plus a parallel close array
+    params = {
+        'period1': int(pd.Timestamp(start_date).tz_localize('UTC').timestamp()),
+        'period2': int(pd.Timestamp(end_date).tz_localize('UTC').timestamp()),
+        'interval': '1d'
+    }
+    response = retry_request(f"{SP500_HISTORY_URL.rstrip('/')}/{SP500_TICKER}", params)
+    if response is None:
+        # Raise rather than return an empty series so a failed range is never recorded as held
+        raise RuntimeError(f"S&P 500 history request failed for {start_date} to {end_date}")
+    result = response.json()['chart']['result'][0]
+    index = pd.to_datetime(result.get('timestamp', []), unit='s', utc=True) \
+        .tz_convert(result['meta'].get('exchangeTimezoneName', 'America/New_York'))
+    return pd.Series(result['indicators']['quote'][0]['close'] if len(index) else [], index=index, dtype=float, name='Close')
+
+class MarketDataStore:
+    """
+    Local time-series store of daily closes for one ticker. Closes live in .npy arrays that are
+    memory-mapped for lookups; a JSON sidecar records which date ranges have been fetched, so
+    only the gaps between held ranges (including closed-market days) ever go to the network.
+    """
+
+    def __init__(self, directory, ticker, fetcher):
+        self.ticker = ticker
+        self.fetcher = fetcher
+        stem = os.path.join(directory, ''.join(c if c.isalnum() else '_' for c in ticker))
+        self.days_path = stem + '_days.npy'
+        self.closes_path = stem + '_closes.npy'
+        self.ranges_path = stem + '_ranges.json'
+        os.makedirs(directory, exist_ok=True)
+
+    def _load(self):
+        """
+        Memory-map the stored arrays and read the held ranges.
+        Returns:
+            tuple: (int64 day numbers, float64 closes, list of [start, end) day-number ranges)
+        """
+        if not os.path.exists(self.ranges_path):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64), []
+        with open(self.ranges_path) as f:
+            ranges = [[day_number(start), day_number(end)] for start, end in json.load(f)['ranges']]
+        return np.load(self.days_path, mmap_mode='r'), np.load(self.closes_path, mmap_mode='r'), ranges
+
+    def _save(self, days, closes, ranges):
+        """
+        Atomically replace the stored arrays and ranges (arrays first, so ranges never claim missing data).
+        Args:
+            days (np.ndarray): Sorted int64 day numbers.
+            closes (np.ndarray): Closes aligned with days.
+            ranges (list): Held [start, end) day-number ranges.
+        Returns:
+            None
+        """
+        for path, values in ((self.days_path, days), (self.closes_path, closes)):
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, values)
+            os.replace(path + '.tmp', path)
+        with open(self.ranges_path + '.tmp', 'w') as f:
+            json.dump({'ticker': self.ticker, 'ranges': [day_number_strings(r) for r in ranges]}, f)
+        os.replace(self.ranges_path + '.tmp', self.ranges_path)
+
+    @staticmethod
+    def missing_ranges(ranges, start, end):
+        """
+        Subtract held ranges from [start, end).
+        Args:
+            ranges (list): Sorted, non-overlapping held [start, end) ranges.
+            start (int): First wanted day number.
+            end (int): Day number after the last wanted day.
+        Returns:
+            list: Gaps as [start, end) day-number ranges.
+        """
+        gaps, cursor = [], start
+        for held_start, held_end in ranges:
+            if held_end <= cursor or held_start >= end:
+                continue
+            if held_start > cursor:
+                gaps.append([cursor, held_start])
+            cursor = max(cursor, held_end)
+        if cursor < end:
+            gaps.append([cursor, end])
+        return gaps
+
+    @staticmethod
+    def merge_ranges(ranges):
+        """
+        Coalesce overlapping or adjacent ranges.
+        Args:
+            ranges (list): [start, end) ranges in any order.
+        Returns:
+            list: Sorted, non-overlapping ranges.
+        """
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    def get_closes(self, start_date, end_date):
+        """
+        Return closes in [start_date, end_date), fetching only ranges not held yet.
+        Args:
+            start_date (str): First date (YYYY-MM-DD), inclusive.
+            end_date (str): Last date (YYYY-MM-DD), exclusive.
+        Returns:
+            pd.Series: Closes indexed by naive exchange-local trading dates.
+        """
+        start, end = day_number(start_date), day_number(end_date)
+        days, closes, ranges = self._load()
+        gaps = self.missing_ranges(ranges, start, end)
+        if gaps:
+            # Recent closes may still be revised or missing, so they are fetched but not marked as held
+            final_end = day_number(datetime.now(timezone.utc).strftime("%Y-%m-%d")) - MARKET_FINAL_AFTER_DAYS
+            new_days, new_closes = [np.asarray(days)], [np.asarray(closes)]
+            for gap_start, gap_end in gaps:
+                gap_start_date, gap_end_date = day_number_strings([gap_start, gap_end])
+                try:
+                    fetched = self.fetcher(gap_start_date, gap_end_date)
+                except Exception as e:
+                    logging.warning(f"{self.ticker} fetch failed for {gap_start_date} to {gap_end_date}: {e}")
+                    continue
+                fetched = fetched.dropna()
+                if not fetched.empty:
+                    new_days.append(fetched.index.tz_localize(None).to_numpy().astype('datetime64[D]').astype(np.int64))
+                    new_closes.append(fetched.to_numpy(dtype=np.float64))
+                if gap_start < final_end:
+                    ranges.append([gap_start, min(gap_end, final_end)])
+            # Later fetches win for days fetched more than once
+            all_days, all_closes = np.concatenate(new_days), np.concatenate(new_closes)
+            last = len(all_days) - 1 - np.unique(all_days[::-1], return_index=True)[1]
+            days, closes = all_days[last], all_closes[last]
+            self._save(days, closes, self.merge_ranges(ranges))
+            logging.info(f"{self.ticker}: fetched {len(gaps)} missing range(s) for {start_date} to {end_date}")
+        lo, hi = np.searchsorted(days, [start, end])
+        return pd.Series(
+            np.asarray(closes[lo:hi]),
+            index=pd.DatetimeIndex(np.asarray(days[lo:hi]).astype('datetime64[D]')),
+            name='Close'
+        )
+
+def asof_lookup(trade_days, closes, day_numbers, lookback_days):
+    """
+    Vectorized as-of join: the latest close on or before each day, at most lookback_days earlier.
+    Args:
+        trade_days (np.ndarray): Sorted int64 day numbers of the trading calendar.
+        closes (np.ndarray): Closes aligned with trade_days.
+        day_numbers (np.ndarray): Day numbers to look up, in any order.
+        lookback_days (int): Maximum calendar-day gap to the close used; None for unlimited.
+    Returns:
+        np.ndarray: float64 closes aligned with day_numbers, NaN where no close qualifies.
+    """
+    pos = np.searchsorted(trade_days, day_numbers, side='right') - 1
+    found = pos >= 0
+    if lookback_days is not None and len(trade_days):
+        found &= day_numbers - trade_days[pos.clip(0)] <= lookback_days
+    values = np.full(len(day_numbers), np.nan)
+    values[found] = closes[pos[found]]
+    return values
+
+@profiled('batch_fetch_sp500')
+def batch_fetch_sp500(day_numbers, lookback_days=None):
+    """
+    Batch fetch S&P 500 closing prices (yfinance or SP500_HISTORY_URL, through the local store
+    when enabled) and attach the latest close as of each day. Days without trading (weekends,
+    holidays) get the previous close, independent of the order the days are given in.
+    Args:
+        day_numbers (np.ndarray): Day numbers (see utc_day_numbers) to look up, in any order.
+        lookback_days (int): Maximum calendar days back to a close (defaults to MARKET_ASOF_LOOKBACK_DAYS).
+    Returns:
+        np.ndarray: float64 closes aligned with day_numbers, NaN where unavailable.
+    """
+    lookback_days = MARKET_ASOF_LOOKBACK_DAYS if lookback_days is None else lookback_days
+    day_numbers = np.asarray(day_numbers, dtype=np.int64)
+    if not len(day_numbers):
+        return np.empty(0)
+    try:
+        # Start early enough that a non-trading first day still has a close to fall back on
+        start_date, end_date = day_number_strings([day_numbers.min() - (lookback_days or 0), day_numbers.max() + 1])
+        if MARKET_DATA_DIR:
+            closes = MarketDataStore(MARKET_DATA_DIR, SP500_TICKER, fetch_sp500_history).get_closes(start_date, end_date)
+        else:
+            closes = fetch_sp500_history(start_date, end_date)
+        closes = closes.dropna()
+        if closes.empty:
+            return np.full(len(day_numbers), np.nan)
         
-        # Convert index to string for mapping
-        history.index = history.index.strftime("%Y-%m-%d")
-        sp500_data = history['Close'].to_dict()
-       
-        # Fill missing dates with last available price
-        last_price = None
-        date_price_map = {}
-        for date in dates:
-            if date in sp500_data:
-                last_price = sp500_data[date]
-            date_price_map[date] = last_price
-        return date_price_map
+        # Trading calendar as sorted exchange-local day numbers
+        index = closes.index.tz_localize(None) if closes.index.tz is not None else closes.index
+        trade_days = index.to_numpy().astype('datetime64[D]').astype(np.int64)
+        order = np.argsort(trade_days, kind='stable')
+        return asof_lookup(trade_days[order], closes.to_numpy(dtype=np.float64)[order], day_numbers, lookback_days)
     except Exception as e:
         logging.error(f"S&P 500 fetch error: {e}")
-        return {}
+        return np.full(len(day_numbers), np.nan)
+
+class TokenBucket:
+    """
+    Thread-safe token-bucket rate limiter.
+    Allows bursts of up to `capacity` calls and a sustained `rate` calls per second. A call may
+    cost several tokens; costs above the capacity run the bucket into debt that later calls wait off.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Block until enough tokens are available (at most the capacity), then consume them.
+        Args:
+            tokens (int): Cost of the call.
+        Returns:
+            None
+        """
+        needed = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+def create_http_session(pool_size=WEATHER_MAX_WORKERS):
+    """
+    Create a requests Session with a connection pool sized for concurrent use.
+    Args:
+        pool_size (int): Maximum number of pooled connections per host.
+    Returns:
+        requests.Session: Session sharing keep-alive connections across threads.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+class CircuitBreaker:
+    """
+    Thread-safe per-host circuit breaker. After `threshold` consecutive failed requests the
+    circuit opens and new requests fail fast; once `reset_seconds` have passed a single trial
+    request is let through, and its outcome closes the circuit again or re-opens it.
+    """
+
+    def __init__(self, host, threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.host = host
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check whether a new request may start now.
+        Returns:
+            bool: False while the circuit is open or a trial request is in flight.
+        """
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.state = 'closed'
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.threshold:
+                if self.state != 'open':
+                    logging.warning(f"Circuit for {self.host} opened after {self.failures} consecutive failures")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+class RequestRejectedError(RuntimeError):
+    """
+    Raised by retry_request when neither retrying nor splitting the request can help: the
+    host's circuit is open or the server answered with a non-retryable status.
+    """
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+def circuit_breaker_for(url):
+    """
+    Get the shared circuit breaker of a URL's host.
+    Args:
+        url (str): Request URL.
+    Returns:
+        CircuitBreaker: Breaker for the host (created on first use).
+    """
+    host = urlparse(url).netloc
+    with _circuit_breakers_lock:
+        if host not in _circuit_breakers:
+            _circuit_breakers[host] = CircuitBreaker(host)
+        return _circuit_breakers[host]
 
-def retry_request(url, params, retries=3, delay=5):
+class RetryMetrics:
     """
-    Retry a GET request with exponential backoff for robustness.
+    Thread-safe counters for HTTP attempts, retries and time spent sleeping in backoff.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = {'requests': 0, 'attempts': 0, 'retries': 0, 'throttled': 0,
+                           'gave_up': 0, 'circuit_rejected': 0, 'sleep_s': 0.0}
+
+    def add(self, **increments):
+        with self.lock:
+            for key, value in increments.items():
+                self.counts[key] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.counts, 'sleep_s': round(self.counts['sleep_s'], 3)}
+
+retry_metrics = RetryMetrics()
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header given as delay seconds or an HTTP date.
+    Args:
+        value (str): Header value (may be None).
+    Returns:
+        float or None: Seconds to wait, or None if absent or unparseable.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def retry_request(url, params, retries=None, base_delay=None, max_delay=None, session=None, rate_limiter=None,
+                  rate_cost=1):
+    """
+    GET a URL, retrying transient failures with exponential backoff and full jitter.
+    Connection errors, timeouts and HTTP_RETRYABLE_STATUS responses are retried; a Retry-After
+    header replaces the computed backoff. Other error statuses raise RequestRejectedError at once.
+    Each host has a circuit breaker; while it is open requests raise RequestRejectedError without
+    being sent. Sleeps and outcomes are counted in retry_metrics.
     Args:
         url (str): The API endpoint URL.
         params (dict): Query parameters for the request.
-        retries (int): Number of retry attempts.
-        delay (int): Delay in seconds between retries.
+        retries (int): Maximum attempts (defaults to HTTP_RETRY_ATTEMPTS).
+        base_delay (float): Backoff cap before the first retry (defaults to HTTP_RETRY_BASE_DELAY).
+        max_delay (float): Longest single sleep (defaults to HTTP_RETRY_MAX_DELAY).
+        session (requests.Session): Optional session for connection reuse.
+        rate_limiter (TokenBucket): Optional limiter acquired before each attempt.
+        rate_cost (int): Tokens each attempt takes from the rate limiter.
     Returns:
-        requests.Response or None: Response object if successful, None otherwise.
+        requests.Response or None: Response object if successful, None once retries are exhausted.
     """
+    retries = retries or HTTP_RETRY_ATTEMPTS
+    base_delay = HTTP_RETRY_BASE_DELAY if base_delay is None else base_delay
+    max_delay = HTTP_RETRY_MAX_DELAY if max_delay is None else max_delay
+    http = session or requests
+    breaker = circuit_breaker_for(url)
+    retry_metrics.add(requests=1)
+    if not breaker.allow():
+        retry_metrics.add(circuit_rejected=1)
+        raise RequestRejectedError(f"circuit for {breaker.host} is open")
     for attempt in range(retries):
+        if rate_limiter is not None:
+            rate_limiter.acquire(rate_cost)
+        retry_metrics.add(attempts=1)
+        retry_after = None
+        host_answered = False
         try:
-            # Attempt the API request
-            response = requests.get(url, params=params, timeout=15)
-            response.raise_for_status()
-            return response
-        except Exception as e:
+            response = http.get(url, params=params, timeout=15)
+        except requests.RequestException as e:
             logging.warning(f"Attempt {attempt+1} failed: {e}")
-            time.sleep(delay)
+        else:
+            status = response.status_code
+            # Any answer below 500 shows the host is up, even if it is throttling or rejecting us
+            if status < 500:
+                host_answered = True
+                breaker.record_success()
+            if status < 400:
+                return response
+            if status not in HTTP_RETRYABLE_STATUS:
+                # A request ending on a server error counts against the host (and resolves a half-open trial)
+                if status >= 500:
+                    breaker.record_failure()
+                retry_metrics.add(gave_up=1)
+                raise RequestRejectedError(f"non-retryable status {status} from {breaker.host}")
+            if status == 429:
+                retry_metrics.add(throttled=1)
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            logging.warning(f"Attempt {attempt+1} failed with status {status}")
+        if attempt == retries - 1:
+            # A request whose last attempt got no sub-500 answer counts against the host
+            if not host_answered:
+                breaker.record_failure()
+            break
+        # Full jitter spreads concurrent retries out instead of having them fire together
+        delay = retry_after if retry_after is not None else random.uniform(0, base_delay * 2 ** attempt)
+        delay = min(delay, max_delay)
+        retry_metrics.add(retries=1, sleep_s=delay)
+        time.sleep(delay)
+    retry_metrics.add(gave_up=1)
     return None
 
-def batch_fetch_weather(location_dates):
+class WeatherCache:
+    """
+    Persistent SQLite store of daily weather keyed by (lat, lon, date).
+    Historical days never change, so they are kept forever; days newer than
+    WEATHER_FINAL_AFTER_DAYS are provisional and expire after WEATHER_RECENT_TTL_HOURS.
+    """
+
+    def __init__(self, path=WEATHER_CACHE_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS weather ("
+            "lat REAL NOT NULL, lon REAL NOT NULL, date TEXT NOT NULL, "
+            "mean_temp REAL, precipitation REAL, fetched_at REAL NOT NULL, "
+            "PRIMARY KEY (lat, lon, date))"
+        )
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def _is_expired(self, date, fetched_at, now):
+        """
+        Check whether a cached day was provisional when fetched and its TTL has elapsed.
+        Args:
+            date (str): Date string (YYYY-MM-DD) of the cached value.
+            fetched_at (float): Unix timestamp when the value was stored.
+            now (float): Current unix timestamp.
+        Returns:
+            bool: True if the entry must be refetched.
+        """
+        final_before = (datetime.fromtimestamp(fetched_at, timezone.utc) - timedelta(days=WEATHER_FINAL_AFTER_DAYS)).strftime("%Y-%m-%d")
+        if date < final_before:
+            return False
+        return now - fetched_at > WEATHER_RECENT_TTL_HOURS * 3600
+
+    def get_many(self, lat, lon, days):
+        """
+        Look up cached weather for one location and several days.
+        Args:
+            lat (float): Latitude.
+            lon (float): Longitude.
+            days (np.ndarray): int64 day numbers to look up.
+        Returns:
+            tuple: ((hit day numbers, mean temps, precipitation) as np.ndarray, sorted np.ndarray of missing days)
+        """
+        wanted = np.unique(np.asarray(days, dtype=np.int64))
+        now = time.time()
+        rows = self.conn.execute(
+            "SELECT date, mean_temp, precipitation, fetched_at FROM weather WHERE lat = ? AND lon = ?",
+            (lat, lon)
+        ).fetchall()
+        rows = [row for row in rows if not self._is_expired(row[0], row[3], now)]
+        cached_days = np.array([row[0] for row in rows], dtype='datetime64[D]').astype(np.int64)
+        hit = np.isin(cached_days, wanted)
+        found = (
+            cached_days[hit],
+            np.array([row[1] for row in rows], dtype=np.float64)[hit],
+            np.array([row[2] for row in rows], dtype=np.float64)[hit],
+        )
+        missing = np.setdiff1d(wanted, found[0])
+        self.hits += len(found[0])
+        self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, lat, lon, days, mean_temps, precipitations, commit=True):
+        """
+        Store daily weather values for one location.
+        Args:
+            lat (float): Latitude.
+            lon (float): Longitude.
+            days (np.ndarray): int64 day numbers.
+            mean_temps (np.ndarray): Mean temperatures aligned with days (NaN if unknown).
+            precipitations (np.ndarray): Precipitation sums aligned with days (NaN if unknown).
+            commit (bool): Commit immediately; pass False to batch several calls and call commit() later.
+        Returns:
+            None
+        """
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO weather (lat, lon, date, mean_temp, precipitation, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(lat, lon, date, None if np.isnan(t) else float(t), None if np.isnan(p) else float(p), now)
+             for date, t, p in zip(day_number_strings(days), mean_temps, precipitations)]
+        )
+        if commit:
+            self.conn.commit()
+
+    def commit(self):
+        """
+        Commit writes made with put_many(..., commit=False).
+        Returns:
+            None
+        """
+        self.conn.commit()
+
+    def evict_expired(self):
+        """
+        Delete provisional entries whose TTL has elapsed.
+        Returns:
+            int: Number of evicted rows.
+        """
+        cursor = self.conn.execute(
+            "DELETE FROM weather WHERE date >= date(fetched_at, 'unixepoch', ?) AND fetched_at < ?",
+            (f"-{WEATHER_FINAL_AFTER_DAYS} days", time.time() - WEATHER_RECENT_TTL_HOURS * 3600)
+        )
+        self.conn.commit()
+        return cursor.rowcount
+
+    def stats(self):
+        """
+        Return cache hit/miss statistics for this session.
+        Returns:
+            dict: {'hits': int, 'misses': int, 'hit_rate': float}
+        """
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+    def close(self):
+        """
+        Close the underlying SQLite connection.
+        Returns:
+            None
+        """
+        self.conn.close()
+
+def snap_coordinates(lats, lons, resolution=WEATHER_GRID_RESOLUTION):
+    """
+    Snap coordinates to the centre of a regular lat/lon grid.
+    Args:
+        lats (array-like): Latitude values.
+        lons (array-like): Longitude values.
+        resolution (float): Grid cell size in degrees. None or 0 returns the inputs unchanged.
+    Returns:
+        tuple: (np.ndarray snapped latitudes, np.ndarray snapped longitudes)
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if not resolution:
+        return lats, lons
+    # Round to 6 decimals so equal cells produce identical float keys
+    return np.round(np.round(lats / resolution) * resolution, 6), np.round(np.round(lons / resolution) * resolution, 6)
+
+def plan_date_ranges(day_numbers, merge_gap_days=None):
+    """
+    Split the dates needed for one location into dense ranges. Neighbouring ranges are merged
+    when at most merge_gap_days unneeded days separate them, since a separate request would
+    cost more than downloading the gap.
+    Args:
+        day_numbers (np.ndarray): Needed int64 day numbers.
+        merge_gap_days (int): Largest gap merged into one request (defaults to WEATHER_RANGE_MERGE_GAP_DAYS).
+    Returns:
+        list: Sorted (start_date, end_date) YYYY-MM-DD pairs, both inclusive.
+    """
+    merge_gap_days = WEATHER_RANGE_MERGE_GAP_DAYS if merge_gap_days is None else merge_gap_days
+    days = np.unique(np.asarray(day_numbers, dtype=np.int64))
+    if not len(days):
+        return []
+    breaks = np.flatnonzero(np.diff(days) - 1 > merge_gap_days) + 1
+    starts = day_number_strings(days[np.r_[0, breaks]])
+    ends = day_number_strings(days[np.r_[breaks - 1, len(days) - 1]])
+    return list(zip(starts, ends))
+
+def plan_location_batches(ranges, max_locations=None, merge_gap_days=None):
+    """
+    Pack per-cell date ranges into multi-location requests that share one date window.
+    Ranges are taken in start order; a range joins the current batch while the batch has room,
+    does not hold its cell yet, and widening the shared window adds at most merge_gap_days of
+    unneeded payload (the cost of the request it saves).
+    Args:
+        ranges (list): ((lat, lon), needed day numbers, start_date, end_date) per planned range.
+        max_locations (int): Batch size limit (defaults to WEATHER_BATCH_MAX_LOCATIONS).
+        merge_gap_days (int): Request cost in days (defaults to WEATHER_RANGE_MERGE_GAP_DAYS).
+    Returns:
+        list: Batches, each a list of range tuples.
+    """
+    max_locations = max_locations or WEATHER_BATCH_MAX_LOCATIONS
+    merge_gap_days = WEATHER_RANGE_MERGE_GAP_DAYS if merge_gap_days is None else merge_gap_days
+    batches, batch, cells = [], [], set()
+    window_start = window_end = 0
+    for item in sorted(ranges, key=lambda item: (item[2], item[3])):
+        start, end = day_number(item[2]), day_number(item[3])
+        if batch:
+            new_end = max(window_end, end)
+            # Extra days downloaded across the batch if this range shares its window
+            added_days = (len(batch) + 1) * (new_end - window_start + 1) \
+                - len(batch) * (window_end - window_start + 1) - (end - start + 1)
+            if len(batch) < max_locations and item[0] not in cells and added_days <= merge_gap_days:
+                batch.append(item)
+                cells.add(item[0])
+                window_end = new_end
+                continue
+            batches.append(batch)
+        batch, cells = [item], {item[0]}
+        window_start, window_end = start, end
+    if batch:
+        batches.append(batch)
+    return batches
+
+def fetch_weather_batch(batch, session=None, rate_limiter=None):
+    """
+    Request the archive for all locations of a batch over their shared date window.
+    Args:
+        batch (list): Range tuples from plan_location_batches.
+        session (requests.Session): Shared HTTP session.
+        rate_limiter (TokenBucket): Shared rate limiter.
+    Returns:
+        list or None: One daily payload per batch location, in batch order; None if the request
+            failed or the response does not match the batch. RequestRejectedError propagates.
+    """
+    params = {
+        'latitude': ','.join(str(lat) for (lat, _), _, _, _ in batch),
+        'longitude': ','.join(str(lon) for (_, lon), _, _, _ in batch),
+        'start_date': min(item[2] for item in batch),
+        'end_date': max(item[3] for item in batch),
+        'daily': ['temperature_2m_mean', 'precipitation_sum'],
+        'timezone': TIMEZONE
+    }
+    # The API counts a multi-location request as one call per location
+    response = retry_request(WEATHER_API_URL, params, session=session, rate_limiter=rate_limiter, rate_cost=len(batch))
+    if not response:
+        return None
+    data = orjson.loads(response.content) if orjson is not None else response.json()
+    # A single location comes back as an object, several as a list in request order
+    payloads = data if isinstance(data, list) else [data]
+    return payloads if len(payloads) == len(batch) else None
+
+def decode_daily_weather(payload):
+    """
+    Decode one location's archive payload into column arrays.
+    Args:
+        payload (dict): Per-location response body with a 'daily' section.
+    Returns:
+        tuple or None: (int64 day numbers, float64 mean temps, float64 precipitation), NaN for
+            missing values; None if the payload has no daily data.
+    """
+    daily = payload.get('daily')
+    if not daily:
+        return None
+    return (
+        np.array(daily['time'], dtype='datetime64[D]').astype(np.int64),
+        np.array(daily['temperature_2m_mean'], dtype=np.float64),
+        np.array(daily['precipitation_sum'], dtype=np.float64),
+    )
+
+class WeatherMatrix:
+    """
+    Dense weather lookup: one row per grid cell and one column per day from first_day on,
+    holding float32 mean temperature and precipitation (NaN where unknown). Any number of
+    orders is looked up with one vectorized gather. The arrays can be saved as .npy files and
+    memory-mapped, so several processes share a single copy through the page cache.
+    """
+
+    def __init__(self, cell_lats, cell_lons, first_day, mean_temp, precipitation, resolution=None):
+        self.cell_lats = cell_lats
+        self.cell_lons = cell_lons
+        self.first_day = int(first_day)
+        self.mean_temp = mean_temp
+        self.precipitation = precipitation
+        self.resolution = resolution
+        self._cells = pd.MultiIndex.from_arrays([np.asarray(cell_lats), np.asarray(cell_lons)])
+
+    def __len__(self):
+        return len(self.cell_lats)
+
+    @classmethod
+    def from_columns(cls, cell_lats, cell_lons, days, mean_temps, precipitations, resolution=None):
+        """
+        Build a matrix from per-(cell, day) value columns.
+        Args:
+            cell_lats (np.ndarray): Cell latitudes.
+            cell_lons (np.ndarray): Cell longitudes.
+            days (np.ndarray): int64 day numbers.
+            mean_temps (np.ndarray): Mean temperatures.
+            precipitations (np.ndarray): Precipitation sums.
+            resolution (float): Grid resolution the cells were snapped with (None if not snapped).
+        Returns:
+            WeatherMatrix: Matrix spanning every cell and the days between the first and last day.
+        """
+        codes, cells = pd.MultiIndex.from_arrays([cell_lats, cell_lons]).factorize()
+        first_day = int(days.min()) if len(days) else 0
+        n_days = int(days.max()) - first_day + 1 if len(days) else 0
+        offsets = (days - first_day).astype(np.int32)
+        matrices = []
+        for values in (mean_temps, precipitations):
+            matrix = np.full((len(cells), n_days), np.nan, dtype=np.float32)
+            matrix[codes, offsets] = values
+            matrices.append(matrix)
+        return cls(cells.get_level_values(0).to_numpy(np.float64), cells.get_level_values(1).to_numpy(np.float64),
+                   first_day, *matrices, resolution=resolution)
+
+    def gather(self, lats, lons, day_numbers):
+        """
+        Look up weather for arrays of locations and days.
+        Args:
+            lats (array-like): Latitudes (snapped to the matrix grid here).
+            lons (array-like): Longitudes.
+            day_numbers (array-like): int64 day numbers.
+        Returns:
+            tuple: (float32 mean temps, float32 precipitation) aligned with the inputs,
+                NaN for invalid coordinates, unknown cells and days outside the matrix.
+        """
+        valid, _ = validate_coordinate_arrays(lats, lons, regions=[])
+        cell_lats, cell_lons = snap_coordinates(lats, lons, self.resolution)
+        rows = self._cells.get_indexer(pd.MultiIndex.from_arrays([cell_lats, cell_lons]))
+        offsets = np.asarray(day_numbers, dtype=np.int64) - self.first_day
+        found = valid & (rows >= 0) & (offsets >= 0) & (offsets < self.mean_temp.shape[1])
+        rows, offsets = rows[found], offsets[found].astype(np.int32)
+        results = []
+        for matrix in (self.mean_temp, self.precipitation):
+            values = np.full(len(found), np.nan, dtype=np.float32)
+            values[found] = matrix[rows, offsets]
+            results.append(values)
+        return tuple(results)
+
+    def save(self, directory):
+        """
+        Write the matrix as .npy arrays plus a JSON sidecar.
+        Args:
+            directory (str): Target directory (created if needed).
+        Returns:
+            None
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in ('cell_lats', 'cell_lons', 'mean_temp', 'precipitation'):
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+        with open(os.path.join(directory, 'weather_matrix.json'), 'w') as f:
+            json.dump({'first_day': self.first_day, 'resolution': self.resolution}, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Open a matrix written by save, memory-mapped by default.
+        Args:
+            directory (str): Directory passed to save.
+            mmap_mode (str): np.load mmap mode; None reads the arrays into memory.
+        Returns:
+            WeatherMatrix: Loaded matrix.
+        """
+        with open(os.path.join(directory, 'weather_matrix.json')) as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)
+                  for name in ('cell_lats', 'cell_lons', 'mean_temp', 'precipitation')]
+        return cls(arrays[0], arrays[1], meta['first_day'], arrays[2], arrays[3], resolution=meta['resolution'])
+
+@profiled('batch_fetch_weather')
+def batch_fetch_weather(location_days, cache=None, max_workers=None, requests_per_second=None):
     """
-    Batch fetch weather data for multiple (lat, lon, date) combinations using Open-Meteo API.
+    Batch fetch weather data for multiple (lat, lon, day) combinations using Open-Meteo API.
+    Cached days are served from the on-disk WeatherCache; only missing dates hit the API.
+    Requests run concurrently on a thread pool sharing one HTTP session and a token-bucket limiter.
+    Locations are snapped to WEATHER_GRID_RESOLUTION cells so nearby points share requests, and
+    each cell's dates are split into dense ranges (see plan_date_ranges) rather than one min–max span.
+    Ranges are packed into multi-location requests (see plan_location_batches); a failed batch is
+    split in half and retried down to single locations. Responses are decoded into arrays and
+    collected column-wise into a WeatherMatrix over the grid cells; fetched windows are written to
+    the cache in transactions of WEATHER_CACHE_COMMIT_EVERY payloads.
     Args:
-        location_dates (list): List of tuples: ((lat, lon), date_string)
+        location_days (pd.DataFrame): WEATHER_JOIN_KEYS rows (latitude, longitude, day number) to look up.
+        cache (WeatherCache): Optional cache instance. Defaults to one at WEATHER_CACHE_DB (if set).
+        max_workers (int): Maximum number of concurrent requests. Defaults to WEATHER_MAX_WORKERS.
+        requests_per_second (float): Sustained location-call rate allowed by the rate limiter.
+            Defaults to WEATHER_REQUESTS_PER_SECOND.
     Returns:
-        dict: Mapping from (lat, lon, date) to weather data dict {'mean_temp': float, 'precipitation': float}
+        WeatherMatrix: Cell × day weather lookup covering the requested location-days.
     """
-    weather_data = {}
-    location_groups = defaultdict(list)
+    max_workers = max_workers or WEATHER_MAX_WORKERS
+    requests_per_second = requests_per_second or WEATHER_REQUESTS_PER_SECOND
+    lat_col, lon_col, day_col = WEATHER_JOIN_KEYS
+    owns_cache = cache is None and WEATHER_CACHE_DB is not None
+    if owns_cache:
+        cache = WeatherCache(WEATHER_CACHE_DB)
+        cache.evict_expired()
     
-    # Group requests by location to minimize API calls
-    for (lat, lon), date in location_dates:
-        location_groups[(lat, lon)].append(date)
-    for (lat, lon), dates in location_groups.items():
-        if not validate_coordinates(lat, lon):
-            continue
-        start_date = min(dates)
-        end_date = max(dates)
-        params = {
-            'latitude': lat,
-            'longitude': lon,
-            'start_date': start_date,
-            'end_date': end_date,
-            'daily': ['temperature_2m_mean', 'precipitation_sum'],
-            'timezone': TIMEZONE
-        }
-        
-        # Use retry logic for robustness
-        response = retry_request(WEATHER_API_URL, params)
-        if response:
-            data = response.json()
-            if 'daily' in data:
-                for i, date in enumerate(data['daily']['time']):
-                    if date in dates:
-                        weather_data[(lat, lon, date)] = {
-                            'mean_temp': data['daily']['temperature_2m_mean'][i],
-                            'precipitation': data['daily']['precipitation_sum'][i]
-                        }
-    return weather_data
+    # Distinct valid location-days, each assigned to its grid cell
+    requested = location_days[WEATHER_JOIN_KEYS].drop_duplicates()
+    valid, _ = validate_coordinate_arrays(requested[lat_col], requested[lon_col], regions=[])
+    requested = requested[valid]
+    cell_lats, cell_lons = snap_coordinates(requested[lat_col], requested[lon_col], WEATHER_GRID_RESOLUTION)
+    requested = requested.assign(cell_lat=cell_lats, cell_lon=cell_lons)
+    cell_days = requested[['cell_lat', 'cell_lon', day_col]].drop_duplicates().groupby(['cell_lat', 'cell_lon'], sort=False)[day_col]
+    n_locations = len(requested[[lat_col, lon_col]].drop_duplicates())
+    logging.info(f"Snapped {n_locations} locations to {cell_days.ngroups} weather cells")
 
-def enrich_data(df):
+    # Columnar result buffer: one array chunk per cell and source
+    chunks = {'cell_lat': [], 'cell_lon': [], 'day': [], 'mean_temp': [], 'precipitation': []}
+
+    def collect(lat, lon, days, mean_temps, precipitations):
+        chunks['cell_lat'].append(np.full(len(days), lat))
+        chunks['cell_lon'].append(np.full(len(days), lon))
+        chunks['day'].append(days)
+        chunks['mean_temp'].append(mean_temps)
+        chunks['precipitation'].append(precipitations)
+
+    # Plan dense date ranges per cell for the days not already cached
+    pending = []
+    requested_days = needed_days = 0
+    for (lat, lon), days in cell_days:
+        lat, lon, days = float(lat), float(lon), np.sort(days.to_numpy(np.int64))
+        if cache is not None:
+            # Serve cached days and only request the days still missing
+            found, days = cache.get_many(lat, lon, days)
+            collect(lat, lon, *found)
+            if not len(days):
+                continue
+        needed_days += len(days)
+        for start_date, end_date in plan_date_ranges(days):
+            pending.append(((lat, lon), days, start_date, end_date))
+            requested_days += day_number(end_date) - day_number(start_date) + 1
+    batches = plan_location_batches(pending)
+    if pending:
+        logging.info(f"Planned {len(pending)} date ranges covering {requested_days} days for {needed_days} needed days, "
+                     f"packed into {len(batches)} requests")
+
+    # Fetch concurrently; responses are decoded and cached on this thread (SQLite is not shared)
+    if batches:
+        session = create_http_session(max_workers)
+        limiter = TokenBucket(requests_per_second)
+        rejected = []
+        uncommitted = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(fetch_weather_batch, batch, session, limiter): batch for batch in batches}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = futures.pop(future)
+                    try:
+                        payloads = future.result()
+                    except RequestRejectedError as e:
+                        # Smaller batches would be rejected the same way, so the batch is not split
+                        rejected.append((batch, e))
+                        continue
+                    if payloads is None:
+                        # Fall back to smaller batches; a single location that fails is given up
+                        if len(batch) > 1:
+                            half = len(batch) // 2
+                            logging.warning(f"Weather batch of {len(batch)} locations failed; retrying as {half} + {len(batch) - half}")
+                            for part in (batch[:half], batch[half:]):
+                                futures[executor.submit(fetch_weather_batch, part, session, limiter)] = part
+                        continue
+                    for ((lat, lon), needed, start_date, end_date), payload in zip(batch, payloads):
+                        decoded = decode_daily_weather(payload)
+                        if decoded is None:
+                            continue
+                        days, mean_temps, precipitations = decoded
+                        # Keep needed days of this range only; the shared window may overlap another range of the cell
+                        wanted = needed[np.searchsorted(needed, day_number(start_date)):
+                                        np.searchsorted(needed, day_number(end_date), side='right')]
+                        positions = np.minimum(np.searchsorted(days, wanted), max(len(days) - 1, 0))
+                        keep = positions[days[positions] == wanted] if len(days) else positions[:0]
+                        collect(lat, lon, days[keep], mean_temps[keep], precipitations[keep])
+                        # Store the whole fetched window so later backfills can reuse it
+                        if cache is not None:
+                            cache.put_many(lat, lon, days, mean_temps, precipitations, commit=False)
+                            uncommitted += 1
+                            if uncommitted >= WEATHER_CACHE_COMMIT_EVERY:
+                                cache.commit()
+                                uncommitted = 0
+        if cache is not None and uncommitted:
+            cache.commit()
+        session.close()
+        if rejected:
+            logging.warning(f"{len(rejected)} weather requests ({sum(len(batch) for batch, _ in rejected)} locations) "
+                            f"not fetched, e.g. {rejected[-1][1]}")
+
+    if cache is not None:
+        logging.info(f"Weather cache stats: {cache.stats()}")
+        if owns_cache:
+            cache.close()
+
+    columns = [np.concatenate(values) if values else np.empty(0, dtype=np.int64 if name == 'day' else np.float64)
+               for name, values in chunks.items()]
+    return WeatherMatrix.from_columns(*columns, resolution=WEATHER_GRID_RESOLUTION)
+
+def utc_day_numbers(timestamps):
     """
-    Enrich the joined Olist data with market sentiment and weather data.
+    Convert UTC timestamps to integer day numbers (days since 1970-01-01), a cheap join key.
+    Args:
+        timestamps (pd.Series): Timezone-aware UTC timestamps without NaT.
+    Returns:
+        np.ndarray: int64 day numbers.
+    """
+    return timestamps.dt.tz_localize(None).to_numpy().astype('datetime64[D]').astype(np.int64)
+
+def day_number(date):
+    """
+    Convert a YYYY-MM-DD date string to its day number (days since 1970-01-01).
+    Args:
+        date (str): Date string.
+    Returns:
+        int: Day number.
+    """
+    return int(np.datetime64(date, 'D').astype(np.int64))
+
+def day_number_strings(day_numbers):
+    """
+    Format day numbers as YYYY-MM-DD strings (the API and cache key format).
+    Args:
+        day_numbers (np.ndarray): int64 day numbers.
+    Returns:
+        list: Date strings.
+    """
+    return np.datetime_as_string(np.asarray(day_numbers, dtype=np.int64).astype('datetime64[D]'), unit='D').tolist()
+
+def apply_enrichment_lookups(df, market_table, weather_matrix):
+    """
+    Join the market lookup table onto orders, gather weather from the matrix and keep the output fields.
+    The market lookup is unique on its key, so the input index carries through.
+    Args:
+        df (pd.DataFrame): Joined orders with purchase_day_num and delivery_day_num columns.
+        market_table (pd.DataFrame): purchase_day_num -> market_sentiment_on_purchase_date.
+        weather_matrix (WeatherMatrix): Delivery location × day weather lookup.
+    Returns:
+        pd.DataFrame: Enriched rows indexed like the input, with IDs as plain strings.
+    """
+    result = df.merge(market_table, on='purchase_day_num', how='left')
+    result.index = df.index
+    lat_col, lon_col, day_col = WEATHER_JOIN_KEYS
+    result['delivery_date_mean_temp'], result['delivery_date_precipitation_sum'] = weather_matrix.gather(
+        result[lat_col].to_numpy(), result[lon_col].to_numpy(), result[day_col].to_numpy()
+    )
+    result = result.dropna(subset=OUTPUT_FIELDS)[OUTPUT_FIELDS]
+    # Compacted IDs are categorical; sinks get plain strings rather than per-file dictionaries
+    categorical = [col for col in OUTPUT_FIELDS if isinstance(result[col].dtype, pd.CategoricalDtype)]
+    return result.astype({col: str for col in categorical}) if categorical else result
+
+def prepare_enrichment(df):
+    """
+    Convert the order timestamps to UTC and add the day-number keys the enrichment lookups join on.
     Args:
         df (pd.DataFrame): DataFrame with joined Olist and geolocation data.
     Returns:
-        pd.DataFrame: Enriched DataFrame with market sentiment and weather columns added.
+        pd.DataFrame: Rows with valid timestamps, plus purchase_day_num and delivery_day_num columns.
     """
-    
     # Convert timestamps to timezone-aware datetimes
     df['order_purchase_timestamp'] = pd.to_datetime(df['order_purchase_timestamp']) \
         .dt.tz_localize(TIMEZONE, ambiguous='NaT', nonexistent='NaT') \
@@ -294,63 +1926,797 @@ def enrich_data(df):
         .dt.tz_convert('UTC')
     
     # Drop rows with invalid timestamps
-    df = df.dropna(subset=['order_purchase_timestamp', 'order_delivered_customer_date'])
+    df = df.dropna(subset=['order_purchase_timestamp', 'order_delivered_customer_date']).reset_index(drop=True)
+    # Integer day keys replace per-row strftime; only distinct days are formatted as strings
+    df['purchase_day_num'] = utc_day_numbers(df['order_purchase_timestamp'])
+    df['delivery_day_num'] = utc_day_numbers(df['order_delivered_customer_date'])
+    return df
+
+def build_market_table(purchase_days):
+    """
+    Fetch S&P 500 closes for distinct purchase days as a lookup table.
+    Args:
+        purchase_days (np.ndarray): Distinct int64 purchase day numbers.
+    Returns:
+        pd.DataFrame: purchase_day_num -> market_sentiment_on_purchase_date.
+    """
+    return pd.DataFrame({
+        'purchase_day_num': purchase_days,
+        'market_sentiment_on_purchase_date': batch_fetch_sp500(purchase_days),
+    })
+
+@profiled('enrich_data')
+def enrich_data(df):
+    """
+    Enrich the joined Olist data with market sentiment and weather data.
+    Args:
+        df (pd.DataFrame): DataFrame with joined Olist and geolocation data.
+    Returns:
+        pd.DataFrame: Enriched DataFrame with market sentiment and weather columns added.
+    """
+    df = prepare_enrichment(df)
+
     # Fetch S&P 500 data for all unique purchase dates
-    purchase_dates = df['order_purchase_timestamp'].dt.strftime("%Y-%m-%d").unique()
-    sp500_prices = batch_fetch_sp500(purchase_dates)
-    
-    # Map market sentiment to each order
-    df['market_sentiment_on_purchase_date'] = df['order_purchase_timestamp'].dt.strftime("%Y-%m-%d").map(sp500_prices)
-    # Prepare location-date tuples for weather enrichment
-    location_dates = [((row['delivery_location_latitude'], row['delivery_location_longitude']),
-                      row['order_delivered_customer_date'].strftime("%Y-%m-%d")) for _, row in df.iterrows()]
-    weather_data = batch_fetch_weather(location_dates)
-    
-    # Create a key for each row to map weather data
-    df['weather_key'] = df.apply(lambda row: (
-        row['delivery_location_latitude'],
-        row['delivery_location_longitude'],
-        row['order_delivered_customer_date'].strftime("%Y-%m-%d")), axis=1)
-    
-    # Map weather data to each order
-    df['delivery_date_mean_temp'] = df['weather_key'].map(lambda x: weather_data.get(x, {}).get('mean_temp'))
-    df['delivery_date_precipitation_sum'] = df['weather_key'].map(lambda x: weather_data.get(x, {}).get('precipitation'))
-    df = df.drop(columns=['weather_key'])
-   
-    # Define required output fields
-    final_fields = [
-        'order_id', 'seller_id', 'order_purchase_timestamp', 'order_delivered_customer_date',
-        'total_order_value', 'market_sentiment_on_purchase_date',
-        'delivery_location_latitude', 'delivery_location_longitude',
-        'delivery_date_mean_temp', 'delivery_date_precipitation_sum'
-    ]
-   
-   # Drop rows with missing required fields
-    return df.dropna(subset=final_fields)[final_fields]
+    market_table = build_market_table(pd.unique(df['purchase_day_num']))
+
+    # Request only distinct location-dates
+    weather_matrix = batch_fetch_weather(df[WEATHER_JOIN_KEYS].drop_duplicates())
+
+    # Join the market lookup and gather weather
+    return apply_enrichment_lookups(df, market_table, weather_matrix)
+
+class CsvSink:
+    """
+    Legacy single-file CSV sink. Batches are appended to a temp file that atomically
+    replaces the output on close, so a failed run never leaves a partial file behind.
+    """
+
+    def __init__(self, path=OUTPUT_CSV):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.rows = 0
+
+    def open(self):
+        """
+        Prepare the sink for a new run.
+        Returns:
+            None
+        """
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.rows = 0
+
+    def write(self, df):
+        """
+        Append a batch of enriched rows.
+        Args:
+            df (pd.DataFrame): Enriched rows.
+        Returns:
+            None
+        """
+        df.to_csv(self.tmp_path, mode='a', header=self.rows == 0, index=False)
+        self.rows += len(df)
+
+    def merge(self, df):
+        """
+        Write the existing output with these rows upserted on OUTPUT_KEY (used once per incremental run).
+        Args:
+            df (pd.DataFrame): Enriched rows; they replace earlier versions of the same order/seller.
+        Returns:
+            None
+        """
+        if os.path.exists(self.path):
+            existing = pd.read_csv(self.path, float_precision='round_trip')
+            for col in ['order_purchase_timestamp', 'order_delivered_customer_date']:
+                existing[col] = pd.to_datetime(existing[col], utc=True)
+            df = pd.concat([existing, df], ignore_index=True).drop_duplicates(OUTPUT_KEY, keep='last')
+        self.write(df)
+
+    def close(self):
+        """
+        Publish the written file.
+        Returns:
+            None
+        """
+        if self.rows == 0:
+            # Keep the legacy behaviour of always producing a file with a header
+            pd.DataFrame(columns=OUTPUT_FIELDS).to_csv(self.tmp_path, index=False)
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """
+        Discard the partially written file after a failed run, keeping the previous output.
+        Returns:
+            None
+        """
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def describe(self):
+        """
+        Returns:
+            str: Output location for logging.
+        """
+        return self.path
 
-def main():
+class ParquetSink:
+    """
+    Parquet dataset sink partitioned Hive-style by purchase year/month and optionally a
+    seller_id hash bucket. Files are staged and each month directory is swapped in on
+    close, so re-running a period atomically overwrites all of that month's files.
+    """
+
+    def __init__(self, root=OUTPUT_PARQUET_DIR, compression=PARQUET_COMPRESSION,
+                 row_group_size=PARQUET_ROW_GROUP_SIZE, seller_buckets=PARQUET_SELLER_BUCKETS):
+        if pa is None:
+            raise ImportError("pyarrow is required for the parquet sink")
+        self.root = root
+        self.staging = root + '.staging'
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.seller_buckets = seller_buckets
+        self.batches = 0
+        self.rows = 0
+
+    def open(self):
+        """
+        Prepare an empty staging directory for a new run.
+        Returns:
+            None
+        """
+        shutil.rmtree(self.staging, ignore_errors=True)
+        os.makedirs(self.staging)
+        self.batches = 0
+        self.rows = 0
+
+    def write(self, df):
+        """
+        Write a batch of enriched rows into staged partition files.
+        Args:
+            df (pd.DataFrame): Enriched rows.
+        Returns:
+            None
+        """
+        purchase = df['order_purchase_timestamp']
+        keys = {'purchase_year': purchase.dt.year, 'purchase_month': purchase.dt.month}
+        if self.seller_buckets:
+            keys['seller_bucket'] = pd.util.hash_pandas_object(df['seller_id'].astype(str), index=False) % self.seller_buckets
+        for values, part in df.groupby(list(keys.values())):
+            values = values if isinstance(values, tuple) else (values,)
+            subdir = os.path.join(*[f"{name}={value:02d}" if name == 'purchase_month' else f"{name}={value}"
+                                    for name, value in zip(keys, values)])
+            os.makedirs(os.path.join(self.staging, subdir), exist_ok=True)
+            # Categorical columns would carry their whole dictionary into every file
+            part = part.astype({col: str for col in part.columns if isinstance(part[col].dtype, pd.CategoricalDtype)})
+            table = pa.Table.from_pandas(part.reset_index(drop=True), preserve_index=False)
+            pq.write_table(
+                table,
+                os.path.join(self.staging, subdir, f"part-{self.batches:05d}.parquet"),
+                compression=self.compression,
+                row_group_size=self.row_group_size
+            )
+        self.batches += 1
+        self.rows += len(df)
+
+    def merge(self, df):
+        """
+        Stage each purchase month touched by these rows as its existing rows with the new ones
+        upserted on OUTPUT_KEY; close then swaps in the merged months and leaves the others as they are.
+        Args:
+            df (pd.DataFrame): Enriched rows; they replace earlier versions of the same order/seller.
+        Returns:
+            None
+        """
+        purchase = df['order_purchase_timestamp']
+        frames = []
+        for year, month in set(zip(purchase.dt.year, purchase.dt.month)):
+            month_dir = os.path.join(self.root, f"purchase_year={year}", f"purchase_month={month:02d}")
+            if os.path.exists(month_dir):
+                frames.append(pq.read_table(month_dir, columns=OUTPUT_FIELDS).to_pandas())
+        if frames:
+            df = pd.concat(frames + [df], ignore_index=True).drop_duplicates(OUTPUT_KEY, keep='last')
+        self.write(df)
+
+    def close(self):
+        """
+        Swap each staged month into the dataset, replacing any previous version of that month
+        (including seller buckets the new run no longer produces).
+        Returns:
+            None
+        """
+        os.makedirs(self.root, exist_ok=True)
+        for dirpath, dirnames, filenames in os.walk(self.staging):
+            if not os.path.basename(dirpath).startswith('purchase_month='):
+                continue
+            dirnames.clear()
+            target = os.path.join(self.root, os.path.relpath(dirpath, self.staging))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            old = target + '.old'
+            if os.path.exists(target):
+                os.replace(target, old)
+            os.replace(dirpath, target)
+            shutil.rmtree(old, ignore_errors=True)
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+    def abort(self):
+        """
+        Discard the staged files after a failed run, leaving the dataset untouched.
+        Returns:
+            None
+        """
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+    def describe(self):
+        """
+        Returns:
+            str: Output location for logging.
+        """
+        return self.root
+
+class PostgresSink:
+    """
+    Bulk loader for the seller_order_enriched table. Batches are streamed with
+    COPY FROM STDIN into a session-local staging table over a single connection,
+    then merged with one set-based upsert on close. The connection is opened on the
+    first write, so no transaction sits idle while data is loaded and enriched.
+    """
+
+    def __init__(self, dsn=POSTGRES_DSN, table=POSTGRES_TABLE, batch_rows=POSTGRES_COPY_BATCH_ROWS):
+        if psycopg2 is None:
+            raise ImportError("psycopg2 is required for the postgres sink")
+        if not dsn:
+            raise ValueError("POSTGRES_DSN must be set to use the postgres sink")
+        self.dsn = dsn
+        self.table = table
+        self.batch_rows = batch_rows
+        self.conn = None
+        self.rows = 0
+
+    def open(self):
+        """
+        Prepare the sink for a new run; connecting is deferred to the first write.
+        Returns:
+            None
+        """
+        self.conn = None
+        self.rows = 0
+
+    def _connect(self):
+        """
+        Connect, ensure the target table exists with the upsert key and create the staging table.
+        Returns:
+            None
+        Raises:
+            RuntimeError: If an existing table's primary key is not OUTPUT_KEY (e.g. the older order_id-only key).
+        """
+        self.conn = psycopg2.connect(self.dsn)
+        with self.conn.cursor() as cur:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    order_id VARCHAR(50) NOT NULL,
+                    seller_id VARCHAR(50) NOT NULL,
+                    order_purchase_timestamp TIMESTAMP NOT NULL,
+                    order_delivered_customer_date TIMESTAMP NOT NULL,
+                    total_order_value NUMERIC(12,2) NOT NULL,
+                    market_sentiment_on_purchase_date NUMERIC(10,2),
+                    delivery_location_latitude NUMERIC(9,6),
+                    delivery_location_longitude NUMERIC(9,6),
+                    delivery_date_mean_temp NUMERIC(5,2),
+                    delivery_date_precipitation_sum NUMERIC(5,2),
+                    PRIMARY KEY (order_id, seller_id)
+                )""")
+            # CREATE TABLE IF NOT EXISTS keeps an older table as is; ON CONFLICT needs OUTPUT_KEY as its key
+            cur.execute("""
+                SELECT c.conname, array_agg(a.attname::text)
+                FROM pg_constraint c JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+                WHERE c.conrelid = %s::regclass AND c.contype = 'p'
+                GROUP BY c.conname""", (self.table,))
+            primary_key = cur.fetchone()
+            if primary_key is None or sorted(primary_key[1]) != sorted(OUTPUT_KEY):
+                drop = f"DROP CONSTRAINT {primary_key[0]}, " if primary_key else ""
+                raise RuntimeError(
+                    f"{self.table} has primary key {primary_key[1] if primary_key else None}, expected {OUTPUT_KEY}; "
+                    f"migrate it with: ALTER TABLE {self.table} {drop}ADD PRIMARY KEY ({', '.join(OUTPUT_KEY)})"
+                )
+            cur.execute(f"CREATE TEMP TABLE {self.table}_staging (LIKE {self.table} INCLUDING DEFAULTS) ON COMMIT DROP")
+
+    def write(self, df):
+        """
+        Stream a batch of enriched rows into the staging table with COPY.
+        Timestamps are written in UTC.
+        Args:
+            df (pd.DataFrame): Enriched rows.
+        Returns:
+            None
+        """
+        if self.conn is None:
+            self._connect()
+        copy_sql = f"COPY {self.table}_staging ({', '.join(OUTPUT_FIELDS)}) FROM STDIN WITH (FORMAT csv)"
+        with self.conn.cursor() as cur:
+            for start in range(0, len(df), self.batch_rows):
+                buffer = io.StringIO()
+                df.iloc[start:start + self.batch_rows][OUTPUT_FIELDS].to_csv(buffer, index=False, header=False)
+                buffer.seek(0)
+                cur.copy_expert(copy_sql, buffer)
+        self.rows += len(df)
+
+    def merge(self, df):
+        """
+        Stage rows for an incremental run; close already upserts on OUTPUT_KEY.
+        Args:
+            df (pd.DataFrame): Enriched rows.
+        Returns:
+            None
+        """
+        self.write(df)
+
+    def close(self):
+        """
+        Upsert the staged rows into the target table and commit.
+        Returns:
+            None
+        """
+        if self.conn is None:
+            logging.info(f"No rows to upsert into {self.table}")
+            return
+        updates = ', '.join(f"{col} = EXCLUDED.{col}" for col in OUTPUT_FIELDS if col not in OUTPUT_KEY)
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(f"""
+                    INSERT INTO {self.table} ({', '.join(OUTPUT_FIELDS)})
+                    SELECT {', '.join(OUTPUT_FIELDS)} FROM {self.table}_staging
+                    ON CONFLICT ({', '.join(OUTPUT_KEY)}) DO UPDATE SET {updates}""")
+                logging.info(f"Upserted {cur.rowcount} rows into {self.table}")
+            self.conn.commit()
+        finally:
+            self.conn.close()
+            self.conn = None
+
+    def abort(self):
+        """
+        Roll back and close the connection after a failed run.
+        Returns:
+            None
+        """
+        if self.conn is None:
+            return
+        try:
+            self.conn.rollback()
+        finally:
+            self.conn.close()
+            self.conn = None
+
+    def describe(self):
+        """
+        Returns:
+            str: Output location for logging.
+        """
+        return f"postgres table {self.table}"
+
+SINKS = {'csv': CsvSink, 'parquet': ParquetSink, 'postgres': PostgresSink}
+
+def create_sink(name=OUTPUT_SINK, **options):
+    """
+    Instantiate an output sink by name.
+    Args:
+        name (str): Sink name, one of SINKS.
+        **options: Sink-specific keyword arguments.
+    Returns:
+        object: Sink instance with open/write/merge/close/abort methods.
+    """
+    if name not in SINKS:
+        raise ValueError(f"Unknown output sink '{name}', expected one of {sorted(SINKS)}")
+    return SINKS[name](**options)
+
+def estimate_csv_rows(csv_path, sample_bytes=1 << 20):
+    """
+    Estimate a CSV's row count from its size and the average row length of its first block.
+    Args:
+        csv_path (str): CSV path.
+        sample_bytes (int): Bytes sampled from the start of the file.
+    Returns:
+        int: Estimated number of data rows.
+    """
+    size = os.path.getsize(csv_path)
+    with open(csv_path, 'rb') as f:
+        sample = f.read(sample_bytes)
+    lines = sample.count(b'\n')
+    if len(sample) == size:
+        return max(lines - 1, 0)
+    return int(size / (len(sample) / max(lines, 1)))
+
+def stream_partition_count(csv_paths, rows_per_partition=None):
+    """
+    Choose the number of hash partitions so that no source contributes more than about
+    rows_per_partition rows to a partition, keeping per-partition memory flat as volume grows.
+    Args:
+        csv_paths (list): Source CSVs that will be partitioned together.
+        rows_per_partition (int): Target rows per partition (defaults to STREAM_PARTITION_ROWS).
+    Returns:
+        int: Partition count (at least 1).
+    """
+    rows_per_partition = rows_per_partition or STREAM_PARTITION_ROWS
+    rows = max(estimate_csv_rows(path) for path in csv_paths)
+    return max(1, -(-rows // rows_per_partition))
+
+def spill_partitions(csv_path, columns, spill_dir, n_partitions, chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Stream a CSV in chunks and split its rows into order_id hash partitions on disk.
+    Rows of the same order always land in the same partition, so each partition can be
+    cleaned, joined and aggregated independently.
+    Args:
+        csv_path (str): Source CSV path (must contain order_id).
+        columns (list): Columns to keep.
+        spill_dir (str): Directory for the partition files.
+        n_partitions (int): Number of hash partitions.
+        chunk_rows (int): Rows read per chunk.
+    Returns:
+        list: Partition file paths, indexed by partition number.
+    """
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    paths = [os.path.join(spill_dir, f"{name}_{i:04d}.csv") for i in range(n_partitions)]
+    written = set()
+    for chunk in pd.read_csv(csv_path, usecols=columns, chunksize=chunk_rows, dtype=str):
+        buckets = pd.util.hash_pandas_object(chunk['order_id'].fillna(''), index=False).to_numpy() % n_partitions
+        for i, part in chunk.groupby(buckets):
+            part.to_csv(paths[i], mode='a', header=i not in written, index=False)
+            written.add(i)
+    return [path if i in written else None for i, path in enumerate(paths)]
+
+def read_partition(path, columns, parse_dates=None):
+    """
+    Read one spilled partition back with the same dtypes as the in-memory loader.
+    Args:
+        path (str): Partition file path, or None for an empty partition.
+        columns (list): Expected columns (used to build an empty frame).
+        parse_dates (list): Timestamp columns to parse.
+    Returns:
+        pd.DataFrame: Partition rows.
+    """
+    if path is None:
+        return pd.DataFrame(columns=columns)
+    return pd.read_csv(path, parse_dates=parse_dates or [])
+
+# Lookups of a streaming partition worker, set once per process by _init_stream_worker
+_stream_worker_state = {}
+
+def _init_stream_worker(state):
+    global _active_profiler
+    # Stages are measured in the parent; a forked copy of its profiler would only collect discarded records
+    _active_profiler = None
+    if 'weather_dir' in state:
+        # Memory-mapped, so all workers share one copy of the matrix through the page cache
+        state = {**state, 'weather_matrix': WeatherMatrix.load(state['weather_dir'])}
+    _stream_worker_state.update(state)
+
+def map_partitions(func, tasks, workers, state):
+    """
+    Run a partition function over argument tuples, yielding results in task order.
+    With more than one worker the tasks run on a process pool whose workers receive `state` once
+    through _init_stream_worker; at most two tasks per worker are in flight, so results never pile
+    up ahead of the consumer. With one worker the tasks run in this process.
+    Args:
+        func (callable): Module-level function reading its lookups from _stream_worker_state.
+        tasks (list): Argument tuples, one per partition.
+        workers (int): Number of worker processes.
+        state (dict): Lookups for the workers (a 'weather_dir' is loaded as 'weather_matrix').
+    Yields:
+        object: func's result for each task.
+    """
+    if workers <= 1:
+        _stream_worker_state.update(state)
+        try:
+            for args in tasks:
+                yield func(*args)
+        finally:
+            _stream_worker_state.clear()
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_stream_worker, initargs=(state,)) as pool:
+        pending = collections.deque()
+        for args in tasks:
+            pending.append(pool.submit(func, *args))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def prepare_stream_partition(order_path, item_path, prepared_path):
+    """
+    Clean, join and key one spilled order_id partition, and store it for the enrichment pass.
+    Args:
+        order_path (str): Spilled orders partition.
+        item_path (str): Spilled order_items partition.
+        prepared_path (str): Where to store the prepared rows.
+    Returns:
+        tuple or None: (distinct purchase day numbers, distinct WEATHER_JOIN_KEYS rows), or None if no row joined.
+    """
+    sellers, geo_processed, customers = _stream_worker_state['dimensions']
+    orders = clean_raw_data(
+        read_partition(order_path, OLIST_STAGE_COLUMNS[OLIST_ORDERS_CSV],
+                       ['order_purchase_timestamp', 'order_delivered_customer_date']),
+        'orders'
+    )
+    order_items = clean_raw_data(read_partition(item_path, OLIST_STAGE_COLUMNS[OLIST_ORDER_ITEMS_CSV]), 'order_items')
+    orders, order_items, _ = compact_olist_frames(orders, order_items)
+    joined_data = join_olist_data(sellers, orders, order_items, geo_processed, customers)
+    if joined_data.empty:
+        return None
+    prepared = prepare_enrichment(joined_data)
+    prepared.to_pickle(prepared_path)
+    return pd.unique(prepared['purchase_day_num']), prepared[WEATHER_JOIN_KEYS].drop_duplicates()
+
+def enrich_stream_partition(prepared_path):
+    """
+    Apply the market and weather lookups to one prepared partition.
+    Args:
+        prepared_path (str): File written by prepare_stream_partition.
+    Returns:
+        pd.DataFrame: Enriched rows of the partition.
+    """
+    return apply_enrichment_lookups(pd.read_pickle(prepared_path), _stream_worker_state['market_table'],
+                                    _stream_worker_state['weather_matrix'])
+
+def run_streaming_pipeline(sink, workers=None):
+    """
+    Run the ETL over bounded order_id partitions so peak memory stays flat as order volume grows.
+    Dimension tables (sellers, customers, zip-prefix coordinates) are loaded once as compact lookups;
+    orders and order_items are hash-partitioned to disk. Each partition is cleaned, joined and keyed,
+    then market and weather data are fetched once for the distinct keys of all partitions, and each
+    partition is enriched and appended to the output in partition order. Both partition passes run
+    on `workers` processes, which read their partitions from disk and share the weather matrix as
+    memory-mapped arrays.
+    Args:
+        sink (object): Opened output sink receiving each enriched partition.
+        workers (int): Worker processes (defaults to STREAM_WORKERS).
+    Returns:
+        int: Number of output rows written.
+    """
+    workers = workers or STREAM_WORKERS
+    # Dimension tables are small relative to orders and are held in memory
+    sellers = clean_raw_data(read_olist_table(OLIST_SELLERS_CSV, OLIST_STAGE_COLUMNS[OLIST_SELLERS_CSV]), 'sellers')
+    geo_processed = load_geo_dimension()
+    customers = read_olist_table(OLIST_CUSTOMERS_CSV, OLIST_STAGE_COLUMNS[OLIST_CUSTOMERS_CSV])
+    customers = customers.dropna(subset=['customer_id', 'customer_zip_code_prefix'])
+    customers['customer_zip_code_prefix'] = customers['customer_zip_code_prefix'].astype('category')
+
+    shutil.rmtree(STREAM_SPILL_DIR, ignore_errors=True)
+    os.makedirs(STREAM_SPILL_DIR)
+    try:
+        n_partitions = stream_partition_count([OLIST_ORDERS_CSV, OLIST_ORDER_ITEMS_CSV])
+        logging.info(f"Splitting orders into {n_partitions} hash partitions")
+        order_parts = spill_partitions(OLIST_ORDERS_CSV, OLIST_STAGE_COLUMNS[OLIST_ORDERS_CSV], STREAM_SPILL_DIR, n_partitions)
+        item_parts = spill_partitions(OLIST_ORDER_ITEMS_CSV, OLIST_STAGE_COLUMNS[OLIST_ORDER_ITEMS_CSV], STREAM_SPILL_DIR, n_partitions)
+        tasks = [(order_path, item_path, os.path.join(STREAM_SPILL_DIR, f"prepared_{i:04d}.pkl"))
+                 for i, (order_path, item_path) in enumerate(zip(order_parts, item_parts))
+                 if order_path is not None and item_path is not None]
+
+        # Clean, join and key every partition, collecting the distinct lookup keys
+        prepared_paths, purchase_days, location_days = [], [], []
+        with profile_stage('prepare_partitions'):
+            results = map_partitions(prepare_stream_partition, tasks, workers, {'dimensions': (sellers, geo_processed, customers)})
+            for (_, _, prepared_path), keys in zip(tasks, results):
+                if keys is None:
+                    continue
+                prepared_paths.append(prepared_path)
+                purchase_days.append(keys[0])
+                location_days.append(keys[1])
+        logging.info(f"Prepared {len(prepared_paths)} partitions on {workers} worker process(es)")
+        if not prepared_paths:
+            return 0
+
+        # One fetch covers all partitions, so no location or day is requested twice
+        market_table = build_market_table(pd.unique(np.concatenate(purchase_days)))
+        weather_matrix = batch_fetch_weather(pd.concat(location_days, ignore_index=True))
+        state = {'market_table': market_table, 'weather_matrix': weather_matrix}
+        if workers > 1:
+            weather_dir = os.path.join(STREAM_SPILL_DIR, 'weather_matrix')
+            weather_matrix.save(weather_dir)
+            state = {'market_table': market_table, 'weather_dir': weather_dir}
+
+        total_rows = 0
+        with profile_stage('enrich_partitions'):
+            results = map_partitions(enrich_stream_partition, [(path,) for path in prepared_paths], workers, state)
+            for i, enriched_data in enumerate(results):
+                logging.info(f"Writing partition {i + 1}/{len(prepared_paths)}...")
+                # Append each partition so the full output never has to be held in memory
+                with profile_stage('output', enriched_data) as record:
+                    sink.write(enriched_data)
+                    record['output'] = enriched_data
+                total_rows += len(enriched_data)
+        return total_rows
+    finally:
+        shutil.rmtree(STREAM_SPILL_DIR, ignore_errors=True)
+
+def load_watermark(path=ETL_STATE_FILE):
+    """
+    Load the incremental high-water mark (latest processed delivery timestamp).
+    Args:
+        path (str): State file path.
+    Returns:
+        pd.Timestamp or None: Watermark, or None if no previous run was recorded.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    return pd.Timestamp(state['watermark']) if state.get('watermark') else None
+
+def save_watermark(watermark, path=ETL_STATE_FILE):
+    """
+    Atomically persist the incremental high-water mark.
+    Args:
+        watermark (pd.Timestamp): Latest processed delivery timestamp (source local time).
+        path (str): State file path.
+    Returns:
+        None
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'watermark': watermark.isoformat(), 'updated_at': datetime.now(timezone.utc).isoformat()}, f)
+    os.replace(tmp_path, path)
+
+def filter_new_orders(orders, watermark, lookback_days=INCREMENTAL_LOOKBACK_DAYS):
+    """
+    Keep only orders delivered after the watermark (minus a lookback window).
+    Orders enter the output when they become delivered, so the delivery timestamp is the
+    watermark column; the lookback re-covers rows that arrived late in the source extract.
+    Args:
+        orders (pd.DataFrame): Cleaned orders dataframe.
+        watermark (pd.Timestamp or None): Previous high-water mark.
+        lookback_days (int): Days before the watermark to reprocess.
+    Returns:
+        pd.DataFrame: Orders to process in this run.
+    """
+    if watermark is None:
+        return orders
+    cutoff = watermark - timedelta(days=lookback_days)
+    return orders[pd.to_datetime(orders['order_delivered_customer_date']) > cutoff]
+
+def enrichable_order_ids(df):
+    """
+    Find the joined orders that enrich_data can only drop for missing market or weather values:
+    their timestamps localize cleanly and their delivery coordinates are valid.
+    Args:
+        df (pd.DataFrame): Joined orders, before enrich_data.
+    Returns:
+        set: order_id strings.
+    """
+    ok = np.ones(len(df), dtype=bool)
+    for col in ['order_purchase_timestamp', 'order_delivered_customer_date']:
+        ok &= pd.to_datetime(df[col]).dt.tz_localize(TIMEZONE, ambiguous='NaT', nonexistent='NaT').notna().to_numpy()
+    valid, _ = validate_coordinate_arrays(df['delivery_location_latitude'], df['delivery_location_longitude'], regions=[])
+    return set(df.loc[ok & valid, 'order_id'].astype(str))
+
+def run_incremental_pipeline(sink, state_path=ETL_STATE_FILE):
+    """
+    Process only orders delivered since the last run and merge them into the sink's existing output.
+    Args:
+        sink (object): Opened output sink (see SINKS); closed here before the watermark advances.
+        state_path (str): Watermark state file path.
+    Returns:
+        int: Number of rows processed in this run.
+    """
+    sellers, orders, order_items, customers = load_olist_data()
+    watermark = load_watermark(state_path)
+    new_orders = filter_new_orders(orders, watermark)
+    logging.info(f"Incremental run: {len(new_orders)} of {len(orders)} orders after watermark {watermark}")
+    if new_orders.empty:
+        # Nothing to merge; drop the empty staging and keep the previous output as is
+        sink.abort()
+        return 0
+
+    geo_processed = load_geo_dimension()
+    joined_data = join_olist_data(sellers, new_orders, order_items, geo_processed, customers)
+    enrichable = enrichable_order_ids(joined_data)
+    enriched_data = enrich_data(joined_data)
+    with profile_stage('output', enriched_data) as record:
+        sink.merge(enriched_data)
+        sink.close()
+        record['output'] = enriched_data
+
+    # Advance the watermark only after the output has been written, and only over written orders.
+    # Orders dropped for missing market or weather data (e.g. during an API outage) hold it back
+    # so the next run picks them up again.
+    delivered = pd.to_datetime(new_orders['order_delivered_customer_date'])
+    order_ids = new_orders['order_id'].astype(str)
+    written_ids = set(enriched_data['order_id'].astype(str))
+    new_watermark = delivered[order_ids.isin(written_ids)].max()
+    pending = order_ids.isin(enrichable - written_ids)
+    if pending.any():
+        earliest = delivered[pending].min()
+        logging.warning(f"{int(pending.sum())} orders lack market or weather data; holding the watermark before {earliest}")
+        held = earliest - pd.Timedelta(microseconds=1)
+        new_watermark = held if pd.isna(new_watermark) else min(new_watermark, held)
+    if pd.notna(new_watermark) and (watermark is None or new_watermark > watermark):
+        save_watermark(new_watermark, state_path)
+    return len(enriched_data)
+
+def main(streaming=False, incremental=False, sink=OUTPUT_SINK, profile_dir=None, workers=None):
     """
     Main ETL pipeline function. Loads, cleans, joins, enriches, and outputs the final dataset.
     Orchestrates the full ETL process and handles errors.
+    Args:
+        streaming (bool): Process orders in bounded partitions instead of loading everything in memory.
+        incremental (bool): Process only orders delivered since the last run and merge them into the sink's output.
+        sink (str): Output sink name (see SINKS).
+        profile_dir (str): If set, dump cProfile stats for each top-level stage into this directory.
+        workers (int): Worker processes for streaming runs (defaults to STREAM_WORKERS).
     Returns:
         None
     """
+    global _active_profiler
+    _active_profiler = StageProfiler(profile_dir)
+    retry_metrics.reset()
+    output = None
     try:
+        output = create_sink(sink)
+        output.open()
+        if incremental:
+            total_rows = run_incremental_pipeline(output, ETL_STATE_FILE)
+            logging.info(f"ETL completed! {total_rows} new rows merged into {output.describe()}")
+            return
+        if streaming:
+            total_rows = run_streaming_pipeline(output, workers)
+            with profile_stage('output'):
+                output.close()
+            logging.info(f"ETL completed! {total_rows} rows streamed to {output.describe()}")
+            return
         # Load and clean all datasets
-        sellers, orders, order_items, geolocations, customers = load_olist_data()
-        # Process geolocations (average and validate coordinates)
-        geo_processed = process_geolocations(geolocations)
+        sellers, orders, order_items, customers = load_olist_data()
+        # Load the zip-prefix coordinate dimension (rebuilt only when the geolocation file changes)
+        geo_processed = load_geo_dimension()
         # Join all datasets to get customer-based geolocation for each order
         joined_data = join_olist_data(sellers, orders, order_items, geo_processed, customers)
         # Enrich with market sentiment and weather data
         enriched_data = enrich_data(joined_data)
-        # Output to CSV
-        enriched_data.to_csv(OUTPUT_CSV, index=False)
-        logging.info(f"ETL completed! Output saved to {OUTPUT_CSV}")
+        # Write through the configured sink
+        with profile_stage('output', enriched_data) as record:
+            output.write(enriched_data)
+            output.close()
+            record['output'] = enriched_data
+        logging.info(f"ETL completed! Output saved to {output.describe()}")
         logging.info(enriched_data.head(3).to_string())
     except Exception as e:
         logging.error(f"ETL failed: {e}")
+        if output is not None:
+            # Drop partial output (tmp files, staging directories, open transactions)
+            try:
+                output.abort()
+            except Exception as abort_error:
+                logging.error(f"Failed to abort {output.describe()}: {abort_error}")
         raise
+    finally:
+        # Write the report for failed runs too, to show where time went before the failure
+        if RUN_REPORT_JSON:
+            _active_profiler.write_report(RUN_REPORT_JSON)
+            logging.info(f"Run report written to {RUN_REPORT_JSON}")
+        _active_profiler = None
+
+def parse_args():
+    """
+    Parse command-line options for the ETL run.
+    Returns:
+        argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Enhanced seller performance & order context ETL")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Process orders in bounded hash partitions (for datasets larger than RAM)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Process only orders delivered since the last run's watermark")
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f"Worker processes for --streaming partitions (default {STREAM_WORKERS})")
+    parser.add_argument('--sink', choices=sorted(SINKS), default=OUTPUT_SINK,
+                        help="Output sink; incremental runs merge into its existing output")
+    parser.add_argument('--profile-dir', default=None,
+                        help="Dump cProfile stats for each top-level stage into this directory")
+    args = parser.parse_args()
+    if args.streaming and args.incremental:
+        parser.error("--streaming and --incremental cannot be combined")
+    if args.workers is not None and (not args.streaming or args.workers < 1):
+        parser.error("--workers needs --streaming and at least 1 worker")
+    return args
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    main(streaming=args.streaming, incremental=args.incremental, sink=args.sink, profile_dir=args.profile_dir,
+         workers=args.workers)
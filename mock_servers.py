@@ -0,0 +1,230 @@
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+import pandas as pd
+
+# Setup basic logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Constants
+MOCK_HOST = "127.0.0.1"
+MOCK_PORT = 8099
+WEATHER_PATH = "/v1/archive"
+CHART_PATH = "/v8/finance/chart/"
+STATS_PATH = "/stats"
+DEFAULT_RETRY_AFTER = 1  # Seconds advertised in Retry-After on 429 responses
+
+
+def weather_payload(lat, lon, start_date, end_date):
+    """
+    Build a deterministic Open-Meteo archive payload for one location.
+    Args:
+        lat (float): Latitude.
+        lon (float): Longitude.
+        start_date (str): First date (YYYY-MM-DD), inclusive.
+        end_date (str): Last date (YYYY-MM-DD), inclusive.
+    Returns:
+        dict: Payload with a 'daily' section holding time, temperature_2m_mean and precipitation_sum.
+    """
+    days = pd.date_range(start_date, end_date, freq='D')
+    day_of_year = days.dayofyear.to_numpy()
+    return {
+        'latitude': lat,
+        'longitude': lon,
+        'daily_units': {'time': 'iso8601', 'temperature_2m_mean': '°C', 'precipitation_sum': 'mm'},
+        'daily': {
+            'time': list(days.strftime("%Y-%m-%d")),
+            'temperature_2m_mean': [float(v) for v in np.round(28 - 0.3 * abs(lat) + 4 * np.cos(2 * np.pi * day_of_year / 365), 1)],
+            'precipitation_sum': [float(v) for v in np.round(np.abs(np.sin(day_of_year * lat)) * 10, 1)],
+        },
+    }
+
+def archive_response(query):
+    """
+    Answer an archive query. Comma-separated latitude/longitude lists return a list of
+    per-location payloads, like the real API.
+    Args:
+        query (dict): Parsed query string (values are lists).
+    Returns:
+        dict or list: Response body.
+    """
+    lats = [float(v) for v in query['latitude'][0].split(',')]
+    lons = [float(v) for v in query['longitude'][0].split(',')]
+    payloads = [weather_payload(lat, lon, query['start_date'][0], query['end_date'][0]) for lat, lon in zip(lats, lons)]
+    return payloads if len(payloads) > 1 else payloads[0]
+
+def sp500_closes(start, end):
+    """
+    Deterministic S&P 500-like closes for business days in [start, end).
+    Args:
+        start (str or pd.Timestamp): First date, inclusive.
+        end (str or pd.Timestamp): Last date, exclusive.
+    Returns:
+        pd.Series: Closes indexed by America/New_York trading dates.
+    """
+    index = pd.bdate_range(pd.Timestamp(start), pd.Timestamp(end) - pd.Timedelta(days=1), tz='America/New_York')
+    days = (index.tz_localize(None) - pd.Timestamp("2000-01-01")).days.to_numpy()
+    return pd.Series(2000.0 + 0.5 * days + 20 * np.sin(days / 7.0), index=index, name='Close')
+
+def chart_response(ticker, query):
+    """
+    Answer a Yahoo chart-style history query.
+    Args:
+        ticker (str): Ticker symbol from the URL path.
+        query (dict): Parsed query string with period1/period2 epoch seconds.
+    Returns:
+        dict: Chart API response body.
+    """
+    start = pd.Timestamp(int(query['period1'][0]), unit='s')
+    end = pd.Timestamp(int(query['period2'][0]), unit='s')
+    closes = sp500_closes(start, end)
+    return {
+        'chart': {
+            'result': [{
+                'meta': {'symbol': ticker, 'exchangeTimezoneName': 'America/New_York'},
+                'timestamp': [int(ts.timestamp()) for ts in closes.index],
+                'indicators': {'quote': [{'close': [float(v) for v in closes]}]},
+            }],
+            'error': None,
+        }
+    }
+
+class MockApiHandler(BaseHTTPRequestHandler):
+    """
+    Serves the archive and chart endpoints with the failure behaviour configured on the server.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        server.count('requests')
+        if parsed.path == STATS_PATH:
+            return self.send_json(200, server.snapshot())
+
+        time.sleep(server.latency)
+        roll = server.random()
+        if roll < server.throttle_rate:
+            server.count('throttled')
+            return self.send_json(429, {'error': True, 'reason': 'Too many requests'},
+                                  {'Retry-After': str(server.retry_after)})
+        if roll < server.throttle_rate + server.error_rate:
+            server.count('errors')
+            return self.send_json(500, {'error': True, 'reason': 'Injected failure'})
+
+        try:
+            if parsed.path == WEATHER_PATH:
+                body = archive_response(query)
+            elif parsed.path.startswith(CHART_PATH):
+                body = chart_response(unquote(parsed.path[len(CHART_PATH):]), query)
+            else:
+                return self.send_json(404, {'error': True, 'reason': 'Not found'})
+        except (KeyError, ValueError) as e:
+            return self.send_json(400, {'error': True, 'reason': f"Bad request: {e}"})
+        server.count('ok')
+        return self.send_json(200, body)
+
+    def send_json(self, status, body, headers=None):
+        """
+        Write a JSON response.
+        Args:
+            status (int): HTTP status code.
+            body (object): JSON-serializable body.
+            headers (dict): Extra response headers.
+        Returns:
+            None
+        """
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+class MockApiServer(ThreadingHTTPServer):
+    """
+    Threaded local stand-in for the Open-Meteo archive and Yahoo Finance chart APIs
+    with injectable latency, error rate and 429 throttling.
+    """
+    daemon_threads = True
+
+    def __init__(self, host=MOCK_HOST, port=MOCK_PORT, latency=0.0, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=DEFAULT_RETRY_AFTER, seed=None):
+        super().__init__((host, port), MockApiHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'ok': 0, 'errors': 0, 'throttled': 0}
+
+    def random(self):
+        with self.lock:
+            return self.rng.random()
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+def start_mock_server(**options):
+    """
+    Start a MockApiServer on a background thread (port 0 picks a free port).
+    Args:
+        **options: MockApiServer keyword arguments.
+    Returns:
+        MockApiServer: Running server; call shutdown() to stop it.
+    """
+    server = MockApiServer(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Mock APIs listening on {server.base_url} "
+                 f"(WEATHER_API_URL={server.base_url}{WEATHER_PATH}, SP500_HISTORY_URL={server.base_url}{CHART_PATH.rstrip('/')})")
+    return server
+
+def main():
+    """
+    Command-line entry point: serve the mock APIs until interrupted.
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description="Local mock Open-Meteo archive and Yahoo Finance chart APIs")
+    parser.add_argument('--host', default=MOCK_HOST)
+    parser.add_argument('--port', type=int, default=MOCK_PORT)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with HTTP 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Share of requests answered with HTTP 429")
+    parser.add_argument('--retry-after', type=int, default=DEFAULT_RETRY_AFTER, help="Retry-After seconds on 429")
+    parser.add_argument('--seed', type=int, default=None, help="Seed for reproducible failure injection")
+    args = parser.parse_args()
+
+    server = start_mock_server(host=args.host, port=args.port, latency=args.latency, error_rate=args.error_rate,
+                               throttle_rate=args.throttle_rate, retry_after=args.retry_after, seed=args.seed)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
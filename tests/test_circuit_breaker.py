@@ -0,0 +1,142 @@
+import pytest
+
+import etl_script
+from etl_script import CircuitBreaker, RequestRejectedError, retry_request
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+
+class FakeSession:
+    """Answers each GET with the next status code of a fixed script."""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        return FakeResponse(self.statuses.pop(0))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(etl_script.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(etl_script.time, 'sleep', lambda seconds: None)
+    return now
+
+
+@pytest.fixture
+def breaker(monkeypatch, clock):
+    breaker = CircuitBreaker('weather.test', threshold=3, reset_seconds=30)
+    monkeypatch.setattr(etl_script, 'circuit_breaker_for', lambda url: breaker)
+    return breaker
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+
+
+def test_opens_after_threshold_consecutive_failures(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+def test_success_resets_failure_count(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    assert breaker.failures == 1
+
+
+def test_half_open_after_reset_lets_one_trial_through(breaker, clock):
+    open_breaker(breaker)
+    clock[0] += 29
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()
+
+
+def test_half_open_trial_success_closes(breaker, clock):
+    open_breaker(breaker)
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+
+
+def test_half_open_trial_failure_reopens(breaker, clock):
+    open_breaker(breaker)
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.opened_at == clock[0]
+    assert not breaker.allow()
+
+
+def test_open_circuit_rejects_without_sending(breaker):
+    open_breaker(breaker)
+    session = FakeSession([200])
+    with pytest.raises(RequestRejectedError):
+        retry_request('http://weather.test/v1', {}, session=session)
+    assert session.calls == 0
+
+
+@pytest.mark.parametrize('status', [501, 505, 522])
+def test_non_retryable_server_errors_open_a_closed_circuit(breaker, status):
+    for _ in range(breaker.threshold):
+        with pytest.raises(RequestRejectedError):
+            retry_request('http://weather.test/v1', {}, session=FakeSession([status]))
+    assert breaker.state == 'open'
+
+
+def test_non_retryable_server_error_reopens_half_open_trial(breaker, clock):
+    open_breaker(breaker)
+    clock[0] += 30
+    with pytest.raises(RequestRejectedError):
+        retry_request('http://weather.test/v1', {}, session=FakeSession([522]))
+    assert breaker.state == 'open'
+
+
+def test_client_error_counts_as_host_up(breaker, clock):
+    open_breaker(breaker)
+    clock[0] += 30
+    with pytest.raises(RequestRejectedError):
+        retry_request('http://weather.test/v1', {}, session=FakeSession([404]))
+    assert breaker.state == 'closed'
+
+
+def test_exhausted_retries_ending_on_server_error_count_as_failure(breaker):
+    session = FakeSession([429, 503, 503])
+    assert retry_request('http://weather.test/v1', {}, retries=3, session=session) is None
+    assert breaker.failures == 1
+
+
+def test_exhausted_retries_ending_on_throttle_do_not_count(breaker):
+    session = FakeSession([503, 503, 429])
+    assert retry_request('http://weather.test/v1', {}, retries=3, session=session) is None
+    assert breaker.failures == 0
+    assert breaker.state == 'closed'
+
+
+def test_half_open_trial_retries_then_succeeds(breaker, clock):
+    open_breaker(breaker)
+    clock[0] += 30
+    session = FakeSession([503, 200])
+    assert retry_request('http://weather.test/v1', {}, retries=3, session=session).status_code == 200
+    assert breaker.state == 'closed'
@@ -0,0 +1,83 @@
+"""PostgresSink against a real server; set POSTGRES_TEST_DSN (e.g. "host=localhost dbname=etl_test") to run."""
+import os
+import uuid
+
+import pandas as pd
+import pytest
+
+from etl_script import OUTPUT_FIELDS, PostgresSink
+
+psycopg2 = pytest.importorskip('psycopg2')
+DSN = os.environ.get('POSTGRES_TEST_DSN')
+pytestmark = pytest.mark.skipif(not DSN, reason="POSTGRES_TEST_DSN is not set")
+
+
+def enriched_rows(order_ids, total=10.0):
+    n = len(order_ids)
+    return pd.DataFrame({
+        'order_id': order_ids,
+        'seller_id': ['seller-1'] * n,
+        'order_purchase_timestamp': pd.to_datetime(['2018-01-02 10:00:00'] * n, utc=True),
+        'order_delivered_customer_date': pd.to_datetime(['2018-01-09 15:30:00'] * n, utc=True),
+        'total_order_value': [total] * n,
+        'market_sentiment_on_purchase_date': [2695.81] * n,
+        'delivery_location_latitude': [-23.55] * n,
+        'delivery_location_longitude': [-46.63] * n,
+        'delivery_date_mean_temp': [24.5] * n,
+        'delivery_date_precipitation_sum': [1.2] * n,
+    })[OUTPUT_FIELDS]
+
+
+@pytest.fixture
+def table():
+    name = f"seller_order_enriched_test_{uuid.uuid4().hex[:8]}"
+    yield name
+    with psycopg2.connect(DSN) as conn, conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {name}")
+    conn.close()
+
+
+def query(sql):
+    with psycopg2.connect(DSN) as conn, conn.cursor() as cur:
+        cur.execute(sql)
+        rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def run_sink(table, df, method='write'):
+    sink = PostgresSink(dsn=DSN, table=table)
+    sink.open()
+    getattr(sink, method)(df)
+    sink.close()
+
+
+def test_creates_table_and_loads_rows(table):
+    run_sink(table, enriched_rows(['a', 'b', 'c']))
+    assert query(f"SELECT count(*) FROM {table}") == [(3,)]
+
+
+def test_rerun_upserts_on_order_and_seller(table):
+    run_sink(table, enriched_rows(['a', 'b']))
+    run_sink(table, enriched_rows(['b', 'c'], total=99.0), method='merge')
+    rows = query(f"SELECT order_id, total_order_value FROM {table} ORDER BY order_id")
+    assert [(order_id, float(total)) for order_id, total in rows] == [('a', 10.0), ('b', 99.0), ('c', 99.0)]
+
+
+def test_close_without_rows_does_not_connect(table):
+    sink = PostgresSink(dsn=DSN, table=table)
+    sink.open()
+    sink.close()
+    assert query(f"SELECT to_regclass('{table}')") == [(None,)]
+
+
+def test_rejects_table_keyed_on_order_id_only(table):
+    with psycopg2.connect(DSN) as conn, conn.cursor() as cur:
+        cur.execute(f"CREATE TABLE {table} (order_id VARCHAR(50) PRIMARY KEY, seller_id VARCHAR(50) NOT NULL)")
+    conn.close()
+    sink = PostgresSink(dsn=DSN, table=table)
+    sink.open()
+    with pytest.raises(RuntimeError, match="ADD PRIMARY KEY"):
+        sink.write(enriched_rows(['a']))
+    sink.abort()
+    assert sink.conn is None